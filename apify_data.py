@@ -1,12 +1,17 @@
 from apify_client import ApifyClient
 import time
+import threading
 import json
+import shutil
 from dotenv import load_dotenv
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import gspread
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
 from urllib.parse import urlparse
+from watermarks import WatermarkStore
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +26,66 @@ if not SHEET_ID:
     raise ValueError("GOOGLE_SHEET_ID not found in environment variables")
 
 ACTOR_ID = 'apify/facebook-groups-scraper'
+OUTPUT_FILE = 'facebook_scraped_data.ndjson'
+DATASET_PAGE_SIZE = int(os.getenv('APIFY_DATASET_PAGE_SIZE', '1000'))
+SHARD_COUNT = int(os.getenv('APIFY_SHARDS', '1'))
+MAX_CONCURRENT_RUNS = int(os.getenv('APIFY_MAX_CONCURRENT_RUNS', '4'))
+GROUP_URLS_CACHE_FILE = 'db/group_urls_cache.json'
+GROUP_URLS_CACHE_TTL = int(os.getenv('GROUP_URLS_CACHE_TTL', str(6 * 60 * 60)))
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files/'
+MIN_WAIT_SECS = int(os.getenv('APIFY_MIN_WAIT_SECS', '5'))
+MAX_WAIT_SECS = int(os.getenv('APIFY_MAX_WAIT_SECS', '60'))
+STREAM_WHILE_RUNNING = os.getenv('APIFY_STREAM_WHILE_RUNNING', 'true').lower() == 'true'
+TERMINAL_STATUSES = ['SUCCEEDED', 'FAILED', 'ABORTED', 'TIMED-OUT']
+
+# Only the fields used downstream are downloaded (process_posts reads id, text,
+# url and user; watermarks read time and the group URL)
+DATASET_FIELDS = [
+    field.strip() for field in
+    os.getenv('APIFY_DATASET_FIELDS', 'id,text,url,user,time,inputUrl,facebookUrl').split(',')
+    if field.strip()
+]
+
+# Clients are created once and reused when the stage runs in-process
+_apify_client = None
+_credentials = None
+_sheets_client = None
+_drive_session = None
+
+def get_apify_client():
+    """Get the shared Apify client"""
+    global _apify_client
+    if _apify_client is None:
+        _apify_client = ApifyClient(token=TOKEN)
+    return _apify_client
+
+def get_credentials():
+    """Get the shared Google service account credentials"""
+    global _credentials
+    if _credentials is None:
+        scopes = [
+            'https://www.googleapis.com/auth/spreadsheets',
+            'https://www.googleapis.com/auth/drive'
+        ]
+        _credentials = Credentials.from_service_account_file(
+            'credentials.json',
+            scopes=scopes
+        )
+    return _credentials
+
+def get_sheets_client():
+    """Get the shared Google Sheets client"""
+    global _sheets_client
+    if _sheets_client is None:
+        _sheets_client = gspread.authorize(get_credentials())
+    return _sheets_client
+
+def get_drive_session():
+    """Get the shared authorized session for Drive API calls"""
+    global _drive_session
+    if _drive_session is None:
+        _drive_session = AuthorizedSession(get_credentials())
+    return _drive_session
 
 def is_valid_facebook_url(url):
     """Validate if the URL is a valid Facebook group URL"""
@@ -34,21 +99,64 @@ def is_valid_facebook_url(url):
     except:
         return False
 
+def get_sheet_modified_time():
+    """Get the group URL sheet's last modified time from the Drive API"""
+    response = get_drive_session().get(
+        DRIVE_FILES_URL + SHEET_ID,
+        params={"fields": "modifiedTime", "supportsAllDrives": "true"}
+    )
+    response.raise_for_status()
+    return response.json()["modifiedTime"]
+
+def load_group_urls_cache():
+    """Load the cached group URL list, if any"""
+    try:
+        with open(GROUP_URLS_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_group_urls_cache(urls, modified_time):
+    """Save the validated group URL list with the sheet version it came from"""
+    os.makedirs(os.path.dirname(GROUP_URLS_CACHE_FILE), exist_ok=True)
+    tmp_file = GROUP_URLS_CACHE_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            "modified_time": modified_time,
+            "fetched_at": time.time(),
+            "urls": urls
+        }, f, indent=4)
+    os.replace(tmp_file, GROUP_URLS_CACHE_FILE)
+
 def read_group_urls():
+    """Read Facebook group URLs, using the local cache while the sheet is unchanged"""
+    cache = load_group_urls_cache()
+    try:
+        modified_time = get_sheet_modified_time()
+    except Exception as e:
+        logging.warning(f"Could not check group URL sheet for changes: {str(e)}")
+        modified_time = None
+    
+    if cache:
+        if modified_time is not None and cache.get('modified_time') == modified_time:
+            logging.info(f"Group URL sheet unchanged, using {len(cache['urls'])} cached URLs")
+            return cache['urls']
+        # Fall back to the TTL when the sheet version can't be checked
+        if modified_time is None and time.time() - cache.get('fetched_at', 0) < GROUP_URLS_CACHE_TTL:
+            logging.info(f"Using {len(cache['urls'])} cached group URLs")
+            return cache['urls']
+    
+    urls = fetch_group_urls()
+    try:
+        save_group_urls_cache(urls, modified_time)
+    except Exception as e:
+        logging.warning(f"Could not cache group URLs: {str(e)}")
+    return urls
+
+def fetch_group_urls():
     """Read Facebook group URLs from Google Sheets"""
     try:
-        # Set up Google Sheets credentials
-        scopes = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        
-        credentials = Credentials.from_service_account_file(
-            'credentials.json',
-            scopes=scopes
-        )
-        
-        gc = gspread.authorize(credentials)
+        gc = get_sheets_client()
         
         # Open the spreadsheet and get the first worksheet
         sheet = gc.open_by_key(SHEET_ID).sheet1
@@ -84,6 +192,156 @@ def read_group_urls():
     except Exception as e:
         raise Exception(f"Error reading group URLs from Google Sheets: {str(e)}")
 
+def iter_dataset_pages(client, dataset_id, offset=0, page_size=DATASET_PAGE_SIZE):
+    """Yield (items, next_offset) one dataset page at a time, starting at `offset`
+
+    With clean=True the API skips empty and hidden items but applies offset and
+    limit to raw item positions, so a page can hold fewer items than it covers,
+    or none at all. Offsets therefore advance over the raw positions a page
+    covered, and the loop ends at the dataset total rather than on an empty page.
+    """
+    while True:
+        page = client.dataset(dataset_id).list_items(
+            offset=offset,
+            limit=page_size,
+            fields=DATASET_FIELDS or None,
+            clean=True
+        )
+        offset = min(page.offset + (page.limit or page_size), page.total)
+        if page.items:
+            yield page.items, offset
+        if offset >= page.total:
+            break
+
+def read_post_ids(path):
+    """Read the post ids already saved in an NDJSON file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return {json.loads(line).get('id') for line in f if line.strip()} - {None}
+
+def split_into_shards(items, shards):
+    """Split a list into at most `shards` contiguous batches of similar size"""
+    shards = max(1, min(shards, len(items)))
+    size, remainder = divmod(len(items), shards)
+    batches = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < remainder else 0)
+        batches.append(items[start:end])
+        start = end
+    return [batch for batch in batches if batch]
+
+def build_run_inputs(start_urls, watermarks, shards=1):
+    """Build actor inputs that only fetch posts newer than each group's watermark"""
+    new_groups = [u for u in start_urls if not watermarks.get(u['url'])]
+    known_groups = [u for u in start_urls if watermarks.get(u['url'])]
+    # Sort by watermark so each shard's newer-than filter stays tight
+    known_groups.sort(key=lambda u: watermarks.get(u['url'])['timestamp'])
+    
+    if new_groups and known_groups and shards < 2:
+        # A single run can't filter by watermark while it also covers new groups
+        return [{"startUrls": new_groups + known_groups}]
+    
+    # Split the shard budget between new and known groups so at most `shards` runs start
+    if new_groups and known_groups:
+        new_shards = min(max(1, round(shards * len(new_groups) / len(start_urls))), shards - 1)
+    else:
+        new_shards = shards if new_groups else 0
+    
+    run_inputs = []
+    for batch in split_into_shards(new_groups, new_shards):
+        run_inputs.append({"startUrls": batch})
+    for batch in split_into_shards(known_groups, shards - new_shards):
+        run_input = {"startUrls": batch}
+        # The actor filter is per run, so use the oldest watermark of the batch
+        oldest = watermarks.oldest_timestamp([u['url'] for u in batch])
+        if oldest:
+            run_input["onlyPostsNewerThan"] = oldest.strftime('%Y-%m-%d')
+        run_inputs.append(run_input)
+    return run_inputs
+
+def to_compact_record(item):
+    """Reduce a scraped item to the compact record saved for process_posts"""
+    user = item.get('user') or {}
+    return {
+        "id": item.get('id'),
+        "text": item.get('text') or '',
+        "url": item.get('url') or '',
+        "user": {"id": user.get('id'), "name": user.get('name')},
+        "time": item.get('time'),
+        "inputUrl": item.get('inputUrl') or item.get('facebookUrl')
+    }
+
+def wait_for_run(client, run, on_progress=None):
+    """Wait for a run to finish using server-side waits with exponential backoff"""
+    wait_secs = MIN_WAIT_SECS
+    while run['status'] not in TERMINAL_STATUSES:
+        if on_progress:
+            on_progress(run)
+        # The API holds the request open until the run finishes or the wait expires,
+        # so a finished run is noticed immediately and long runs need few calls
+        run = client.run(run['id']).wait_for_finish(wait_secs=wait_secs) or run
+        logging.info(f"Run {run['id']} status: {run['status']}")
+        wait_secs = min(wait_secs * 2, MAX_WAIT_SECS)
+    return run
+
+class DatasetMerger:
+    """Merge items from concurrent actor runs into one NDJSON file"""
+    
+    def __init__(self, f, watermarks, seen_ids=None):
+        self.f = f
+        self.watermarks = watermarks
+        self.seen_ids = set(seen_ids or ())
+        self.count = 0
+        self.lock = threading.Lock()
+    
+    def write(self, items, observed=None):
+        """Write new items and return how many were kept
+
+        Watermark candidates go to `observed`, so each run's are only used if it succeeds.
+        """
+        written = 0
+        with self.lock:
+            for item in map(to_compact_record, items):
+                # Drop posts at or below the group's watermark and posts already merged from another shard
+                post_id = item.get('id')
+                if not self.watermarks.is_new(item) or (post_id and post_id in self.seen_ids):
+                    continue
+                if post_id:
+                    self.seen_ids.add(post_id)
+                self.watermarks.observe(item, observed)
+                self.f.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+                self.f.write('\n')
+                written += 1
+            self.f.flush()
+            self.count += written
+        logging.info(f"Saved {self.count} new items so far...")
+        return written
+
+def run_actor(client, run_input, merger):
+    """Run the scraper actor, stream its dataset into the merger and return its watermark candidates
+
+    Items of a run that doesn't succeed are still saved, but the run raises so
+    its groups' watermarks don't move past posts it never returned.
+    """
+    run = client.actor(ACTOR_ID).start(run_input=run_input)
+    dataset_id = run['defaultDatasetId']
+    offset = 0
+    observed = {}
+    
+    logging.info(f"Run started. ID: {run['id']}, status: {run['status']}")
+    
+    def fetch_new_items(_run=None):
+        nonlocal offset
+        for items, offset in iter_dataset_pages(client, dataset_id, offset=offset):
+            merger.write(items, observed)
+    
+    # Fetch pages while the run is still producing items, then drain the rest
+    run = wait_for_run(client, run, on_progress=fetch_new_items if STREAM_WHILE_RUNNING else None)
+    fetch_new_items()
+    if run['status'] != 'SUCCEEDED':
+        raise Exception(f"Run {run['id']} finished with status {run['status']}")
+    return observed
+
 def main() -> None:
     # Set up logging
     logging.basicConfig(
@@ -94,34 +352,53 @@ def main() -> None:
     
     try:
         # Initialize client
-        client = ApifyClient(token=TOKEN)
+        client = get_apify_client()
+        watermarks = WatermarkStore()
         
         # Read group URLs from Google Sheets
         start_urls = read_group_urls()
         logging.info(f"Loaded {len(start_urls)} group URLs from Google Sheets")
         
-        # Run the actor with the URLs from Google Sheets
-        run = client.actor(ACTOR_ID).call(run_input={
-            "startUrls": start_urls
-        })
-        
-        logging.info(f"Run started. ID: {run['id']}, status: {run['status']}")
+        run_inputs = build_run_inputs(start_urls, watermarks, SHARD_COUNT)
+        logging.info(f"Starting {len(run_inputs)} actor runs "
+                     f"(max {MAX_CONCURRENT_RUNS} concurrent)")
         
-        # Wait for run to finish
-        while run['status'] not in ['SUCCEEDED', 'FAILED', 'ABORTED']:
-            time.sleep(5)
-            run = client.run(run['id']).get()
-            logging.info(f"Waiting... current status: {run['status']}")
+        # Write to a temporary file so readers never see a half-written dataset;
+        # posts from a previous scrape that haven't been processed yet are kept
+        tmp_file = OUTPUT_FILE + '.tmp'
+        unprocessed_ids = set()
+        append = os.path.exists(OUTPUT_FILE)
+        if append:
+            shutil.copyfile(OUTPUT_FILE, tmp_file)
+            unprocessed_ids = read_post_ids(OUTPUT_FILE)
+            logging.info(f"Appending to {len(unprocessed_ids)} unprocessed items in {OUTPUT_FILE}")
+        failed_runs = 0
+        with open(tmp_file, 'a' if append else 'w', encoding='utf-8') as f, \
+                ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RUNS) as executor:
+            merger = DatasetMerger(f, watermarks, seen_ids=unprocessed_ids)
+            futures = {}
+            for run_input in run_inputs:
+                logging.info(f"Scraping {len(run_input['startUrls'])} groups "
+                             f"(newer than: {run_input.get('onlyPostsNewerThan', 'any')})")
+                futures[executor.submit(run_actor, client, run_input, merger)] = run_input
+            
+            # Each shard merges its dataset into the local NDJSON file as it arrives
+            for future in as_completed(futures):
+                try:
+                    watermarks.accept(future.result())
+                except Exception as e:
+                    failed_runs += 1
+                    logging.error(f"Shard of {len(futures[future]['startUrls'])} groups failed: {str(e)}")
         
-        # Get dataset items (output)
-        dataset_items = client.dataset(run['defaultDatasetId']).list_items().items
+        if run_inputs and failed_runs == len(run_inputs):
+            raise Exception("All actor runs failed")
+        os.replace(tmp_file, OUTPUT_FILE)
         
-        # Save to a local JSON file
-        output_file = 'facebook_scraped_data.json'
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(dataset_items, f, ensure_ascii=False, indent=4)
+        logging.info(f"{merger.count} items saved to {OUTPUT_FILE}")
         
-        logging.info(f"Data saved to {output_file}")
+        # Watermarks advance only once process_posts has stored these posts
+        staged = watermarks.stage()
+        logging.info(f"Staged watermarks for {staged} groups until the posts are processed")
         
     except Exception as e:
         logging.error(f"Error: {str(e)}")
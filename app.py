@@ -1,6 +1,6 @@
 import os
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import time
 import locale
@@ -8,12 +8,25 @@ import json
 import pandas as pd
 from pathlib import Path
 from followup_handler import FollowupHandler
+from followup_scheduler import FollowupScheduler
 from run_data_collection import run_data_collection
 from send_messages import process_unanswered_posts
 from process_posts import process_posts
 from whatsapp_routine import run_whatsapp_routine
 import pytz
 
+# Follow-ups are only sent between these hours, Dubai time; ones that fall due
+# outside the window wait for it to open
+FOLLOWUP_WINDOW_START_HOUR = int(os.getenv("FOLLOWUP_WINDOW_START_HOUR", "9"))
+FOLLOWUP_WINDOW_END_HOUR = int(os.getenv("FOLLOWUP_WINDOW_END_HOUR", "12"))
+# After a failed follow-up run the next one waits this long, doubling up to the maximum
+FOLLOWUP_RETRY_SECS = float(os.getenv("FOLLOWUP_RETRY_SECS", "60"))
+FOLLOWUP_MAX_BACKOFF_SECS = float(os.getenv("FOLLOWUP_MAX_BACKOFF_SECS", "900"))
+
+# Shared across iterations so the sheet is opened once
+_followup_handler = None
+_followup_backoff = {"delay": 0.0, "retry_at": 0.0}
+
 def setup_logging():
     if not os.path.exists("logs"):
         os.makedirs("logs")
@@ -29,42 +42,61 @@ def setup_logging():
     )
     return log_filename
 
-def cleanup():
-    logging.info("Cleaning up...")
-    json_file = "facebook_scraped_data.json"
-    if os.path.exists(json_file):
-        try:
-            os.remove(json_file)
-            logging.info(f"Deleted {json_file}")
-        except Exception as e:
-            logging.error(f"Error deleting {json_file}: {str(e)}")
-
 def run_automation():
     """Run the automation process"""
     logging.info("Starting automation process...")
     try:
         process_unanswered_posts()
-        cleanup()
         logging.info("Automation completed successfully!")
         return True
     except Exception as e:
         logging.error(f"Error during automation: {str(e)}")
         return False
 
+def get_followup_handler():
+    """Get the shared follow-up handler, creating it on first use"""
+    global _followup_handler
+    if _followup_handler is None:
+        _followup_handler = FollowupHandler()
+    return _followup_handler
+
+def followup_retry_at():
+    """Get when follow-ups may be tried again after a failed run"""
+    return _followup_backoff["retry_at"]
+
+def record_followup_run(success):
+    """Reset the follow-up backoff after a successful run, or double it after a failure"""
+    if success:
+        _followup_backoff["delay"] = 0.0
+        _followup_backoff["retry_at"] = 0.0
+        return
+    delay = min(max(_followup_backoff["delay"] * 2, FOLLOWUP_RETRY_SECS), FOLLOWUP_MAX_BACKOFF_SECS)
+    _followup_backoff["delay"] = delay
+    _followup_backoff["retry_at"] = time.time() + delay
+    logging.info(f"Retrying follow-ups in {delay:.0f} seconds")
+
 def run_followups():
     """Run the follow-up processing"""
+    if time.time() < followup_retry_at():
+        logging.info("Follow-ups are backing off after an error, skipping.")
+        return True
     logging.info("Starting follow-up processing...")
     try:
-        followup_handler = FollowupHandler()
-        results = followup_handler.process_followups()
+        results = get_followup_handler().process_followups()
+        if results is None:
+            logging.error("Follow-up processing failed.")
+            record_followup_run(False)
+            return False
         
         if results["successful"] > 0 or results["failed"] > 0:
             logging.info(f"Follow-up processing completed. Successful: {results['successful']}, Failed: {results['failed']}")
         else:
             logging.info("No follow-ups to process.")
+        record_followup_run(True)
         return True
     except Exception as e:
         logging.error(f"Error processing follow-ups: {str(e)}")
+        record_followup_run(False)
         return False
 
 def run_data_collection_process():
@@ -87,7 +119,6 @@ def run_process_posts():
     try:
         success = process_posts()
         if success:
-            cleanup()
             logging.info("Post processing completed successfully!")
         else:
             logging.error("Post processing failed")
@@ -96,20 +127,50 @@ def run_process_posts():
         logging.error(f"Error during post processing: {str(e)}")
         return False
 
+def wait_for_next_iteration(seconds):
+    """Sleep until the next iteration, firing follow-ups as they fall due within the sending window"""
+    scheduler = FollowupScheduler()
+    wait_until = time.time() + seconds
+    while (now := time.time()) < wait_until:
+        next_due = scheduler.next_due_at()
+        window_opens = followup_window_opens_at(get_dubai_time()).timestamp()
+        if next_due is not None and max(next_due.timestamp(), window_opens, followup_retry_at()) <= now:
+            run_followups()
+            now = time.time()
+            next_due = scheduler.next_due_at()
+        # Wake when the next follow-up can be sent, but check at most once a minute
+        if next_due is None:
+            wake_at = wait_until
+        else:
+            wake_at = min(wait_until, max(next_due.timestamp(), window_opens, followup_retry_at(), now + 60))
+        time.sleep(max(0, wake_at - now))
+
 def get_dubai_time():
     """Get the current time in Dubai timezone (UTC+4)"""
     dubai_tz = pytz.timezone('Asia/Dubai')
     return datetime.now(dubai_tz)
 
+def in_followup_window(dubai_now):
+    """Check whether follow-ups may be sent at the given Dubai time"""
+    return FOLLOWUP_WINDOW_START_HOUR <= dubai_now.hour < FOLLOWUP_WINDOW_END_HOUR
+
+def followup_window_opens_at(dubai_now):
+    """Get when follow-ups may next be sent: now inside the window, otherwise its next opening"""
+    if in_followup_window(dubai_now):
+        return dubai_now
+    opening = dubai_now.replace(hour=FOLLOWUP_WINDOW_START_HOUR, minute=0, second=0, microsecond=0)
+    if opening <= dubai_now:
+        opening += timedelta(days=1)
+    return opening
+
 def main():
     # Set up logging
     setup_logging()
     logging.info("Starting continuous automation process...")
     
     iteration = 1
-    # Track last run date for Followups and WhatsApp Routine
+    # Track last run date for WhatsApp Routine
     last_run = {
-        "Followups": None,
         "WhatsApp Routine": None
     }
     
@@ -131,12 +192,12 @@ def main():
             ("Automation", run_automation),
         ]
 
-        # Add Followups and WhatsApp Routine only if in time window and not run today
+        # Add Followups only in the sending window; it only sends the follow-ups that are due
+        if in_followup_window(dubai_now):
+            processes.append(("Followups", run_followups))
+
+        # Add WhatsApp Routine only if in time window and not run today
         if 9 <= dubai_hour < 12 or (dubai_hour == 11 and dubai_minute <= 55):
-            # Followups
-            if last_run["Followups"] != today_str:
-                processes.append(("Followups", run_followups))
-                last_run["Followups"] = today_str
             # WhatsApp Routine
             if last_run["WhatsApp Routine"] != today_str:
                 processes.append(("WhatsApp Routine", run_whatsapp_routine))
@@ -153,8 +214,8 @@ def main():
         logging.info("Waiting 15 minutes before next iteration...")
         logging.info(f"{'='*50}\n")
         
-        # Wait for 15 minutes
-        time.sleep(15 * 60)  # 30 minutes in seconds
+        # Wait for 15 minutes, sending follow-ups that fall due in the meantime
+        wait_for_next_iteration(15 * 60)
         iteration += 1
 
 if __name__ == "__main__":
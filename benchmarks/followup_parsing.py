@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from followup_sheets_handler import HEADERS, DATE_FORMAT, followups_frame, select_followups
+
+def synthetic_values(n_rows: int, seed: int = 0) -> List[List[str]]:
+    """Build raw sheet values shaped like the follow-ups sheet, with a few malformed dates"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    statuses = ['pending', 'completed', 'cancelled']
+    values = [HEADERS]
+    for i in range(n_rows):
+        created_at = start + timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+        created = created_at.strftime(DATE_FORMAT) if rng.random() > 0.001 else 'not a date'
+        values.append([
+            str(i + 1), str(rng.randrange(10 ** 9)), f'user {i}', f'9715{rng.randrange(10 ** 8):08d}',
+            f'https://facebook.com/{i}', (created_at + timedelta(days=1)).strftime(DATE_FORMAT),
+            'Hi, just following up', rng.choice(statuses), created,
+            created_at.strftime(DATE_FORMAT), rng.choice(['TRUE', 'FALSE'])
+        ])
+    return values
+
+def rowwise_select(values: List[List[str]], today) -> Dict[str, List[int]]:
+    """The previous per-record strptime parsing, made to skip malformed rows so it can be timed"""
+    one_day_ago = today - timedelta(days=1)
+    pending, cancelled = [], []
+    for row, record in enumerate(values[1:], start=2):
+        record = dict(zip(values[0], record))
+        try:
+            record['followup_date'] = datetime.strptime(record['followup_date'], DATE_FORMAT).date()
+            record['created_at'] = datetime.strptime(record['created_at'], DATE_FORMAT).date()
+        except ValueError:
+            continue
+        record['user_replied'] = record['user_replied'].lower() == 'true'
+        if record['status'] == 'pending' and record['created_at'] <= one_day_ago and not record['user_replied']:
+            pending.append(row)
+        if record['user_replied'] and record['status'] == 'pending':
+            cancelled.append(row)
+    return {'pending': pending, 'cancelled': cancelled}
+
+def columnar_select(values: List[List[str]], today) -> Dict[str, List[int]]:
+    selected = select_followups(followups_frame(values), today)
+    return {name: frame['row'].tolist() for name, frame in selected.items()}
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+def main(sizes: List[int]) -> bool:
+    today = datetime(2024, 7, 1).date()
+    consistent = True
+    for n_rows in sizes:
+        values = synthetic_values(n_rows)
+        rowwise, rowwise_time = timed(rowwise_select, values, today)
+        columnar, columnar_time = timed(columnar_select, values, today)
+        # The columnar path also cancels replied rows whose dates are malformed
+        same_pending = rowwise['pending'] == columnar['pending']
+        consistent = consistent and same_pending
+        print(f"{n_rows:>9} rows: row-wise {rowwise_time:.2f}s, columnar {columnar_time:.2f}s "
+              f"({rowwise_time / columnar_time:.1f}x), {len(columnar['pending'])} pending, "
+              f"{len(columnar['cancelled'])} to cancel, results match: {same_pending}")
+    return consistent
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time row-wise and columnar parsing of the follow-ups sheet')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='Synthetic row counts to time')
+    args = parser.parse_args()
+
+    if not main(args.sizes):
+        sys.exit(1)
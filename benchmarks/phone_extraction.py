@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from phone_numbers import find_phone_numbers
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "phone_numbers_corpus.jsonl")
+
+LEGACY_PATTERNS = [
+    r'\b\d{10}\b',
+    r'\b\d{11}\b',
+    r'\+\d{10,12}\b',
+    r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',
+    r'\b\d{4}[-.]?\d{3}[-.]?\d{3}\b'
+]
+
+def legacy_extract_phone_numbers(text: str) -> List[str]:
+    """The five-regex extractor previously copied into send_messages and followup_handler"""
+    phone_numbers = []
+    for pattern in LEGACY_PATTERNS:
+        for match in re.finditer(pattern, text):
+            phone = match.group()
+            phone_numbers.append('+' + re.sub(r'\s+', '', phone[1:] if phone.startswith('+') else phone))
+    return phone_numbers
+
+def load_corpus(path: str = CORPUS_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def time_per_post(extract, texts: List[str], repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            extract(text)
+    return (time.perf_counter() - start_time) / (repeat * len(texts))
+
+def main(repeat: int) -> bool:
+    corpus = load_corpus()
+    texts = [case["text"] for case in corpus]
+
+    exact = 0
+    fallback_correct = 0
+    fallbacks = 0
+    for case in corpus:
+        numbers, unresolved = find_phone_numbers(case["text"])
+        if numbers == case["numbers"]:
+            exact += 1
+        else:
+            print(f"Mismatch: {case['text']!r} -> {numbers}, expected {case['numbers']}")
+        fallbacks += bool(unresolved)
+        fallback_correct += bool(unresolved) == case["needs_llm"]
+    legacy_exact = sum(legacy_extract_phone_numbers(case["text"]) == case["numbers"] for case in corpus)
+
+    print(f"Corpus posts: {len(corpus)}")
+    print(f"Exact matches: {exact}/{len(corpus)} (legacy extractor: {legacy_exact}/{len(corpus)})")
+    print(f"LLM fallback decisions correct: {fallback_correct}/{len(corpus)}")
+    print(f"Posts needing the LLM: {fallbacks}/{len(corpus)} ({fallbacks / len(corpus) * 100:.1f}%)")
+    print(f"Deterministic extractor: {time_per_post(find_phone_numbers, texts, repeat) * 1e6:.1f} us/post")
+    print(f"Legacy extractor: {time_per_post(legacy_extract_phone_numbers, texts, repeat) * 1e6:.1f} us/post")
+    return exact == len(corpus) and fallback_correct == len(corpus)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the phone number extractor against the labelled corpus and time it')
+    parser.add_argument('--repeat', type=int, default=1000, help='Passes over the corpus when timing')
+    args = parser.parse_args()
+
+    if not main(args.repeat):
+        sys.exit(1)
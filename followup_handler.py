@@ -2,70 +2,26 @@ import pandas as pd
 import os
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
-import json
 import subprocess
-import re
+from concurrent.futures import ThreadPoolExecutor
 from followup_sheets_handler import FollowupSheetsHandler
+from llm_clients import get_llm
+from phone_numbers import format_phone_number
+from message_history import get_message_history_store
 
 # Load environment variables
 load_dotenv()
 
-def format_phone_number(phone: str) -> str:
-    # Convert to string and handle float values
-    phone = str(int(float(phone))) if isinstance(phone, float) else str(phone)
-    # Remove spaces and keep existing + if present
-    if phone.startswith('+'):
-        return '+' + re.sub(r'\s+', '', phone[1:])
-    return '+' + re.sub(r'\s+', '', phone)
+# How long a follow-up that couldn't be sent waits before it is tried again
+FOLLOWUP_RETRY_HOURS = float(os.getenv("FOLLOWUP_RETRY_HOURS", "24"))
+# Background threads composing follow-up drafts while messages are being sent
+FOLLOWUP_COMPOSE_WORKERS = int(os.getenv("FOLLOWUP_COMPOSE_WORKERS", "2"))
 
-def extract_phone_numbers(text: str) -> List[str]:
-    patterns = [
-        r'\b\d{10}\b',
-        r'\b\d{11}\b',
-        r'\+\d{10,12}\b',
-        r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',
-        r'\b\d{4}[-.]?\d{3}[-.]?\d{3}\b'
-    ]
-    
-    phone_numbers = []
-    for pattern in patterns:
-        matches = re.finditer(pattern, text)
-        for match in matches:
-            phone_numbers.append(format_phone_number(match.group()))
-    
-    return phone_numbers
-
-class FollowupHandler:
-    def __init__(self, credentials_file="credentials.json"):
-        self.sheets_handler = FollowupSheetsHandler(credentials_file=credentials_file)
-    
-    def get_message_history(self, user_id: str) -> List[Dict]:
-        """Get message history for a user"""
-        history_file = f"db/history/{user_id}.json"
-        if os.path.exists(history_file):
-            with open(history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
-    
-    def compose_followup_message(self, username: str, post_url: str, user_id: str) -> str:
-        """Compose a follow-up message using Groq"""
-        try:
-            # Initialize Groq model
-            llm = ChatGroq(
-                model_name=os.getenv("GROQ_MODEL", "mixtral-8x7b-32768"),
-                temperature=float(os.getenv("TEMPERATURE", "0.7")),
-                api_key=os.getenv("GROQ_API_KEY")
-            )
-            
-            # Get message history
-            message_history = self.get_message_history(user_id)
-            
-            # Create prompt template
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """Your task is to compose an engaging follow-up message that maintains the conversation and shows continued interest.
+# Follow-up message prompt, built once at import
+FOLLOWUP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Your task is to compose an engaging follow-up message that maintains the conversation and shows continued interest.
 
                 History text:
                 {message_history}
@@ -84,7 +40,26 @@ class FollowupHandler:
                 Hi hope you having a good morning , do you have any staff or any type of event requirements which Ta'al can 100% take care of ,completely on your budget? Please let me know. Thanks                
                 
                 """),
-            ])
+])
+
+class FollowupHandler:
+    def __init__(self, credentials_file="credentials.json"):
+        self.sheets_handler = FollowupSheetsHandler(credentials_file=credentials_file)
+        # Drafts being composed in the background, by follow-up id
+        self.composer = ThreadPoolExecutor(max_workers=FOLLOWUP_COMPOSE_WORKERS)
+        self.drafts = {}
+    
+    def get_message_history(self, user_id: str) -> List[Dict]:
+        """Get the last few messages sent to a user"""
+        return get_message_history_store().last_n(user_id, 3)
+    
+    def compose_followup_message(self, username: str, post_url: str, user_id: str) -> str:
+        """Compose a follow-up message using Groq"""
+        try:
+            llm = get_llm(float(os.getenv("TEMPERATURE", "0.7")))
+            
+            # Get message history
+            message_history = self.get_message_history(user_id)
             
             # Format message history for the prompt
             formatted_history = "\n".join([
@@ -93,7 +68,7 @@ class FollowupHandler:
             ]) if message_history else "No previous messages"
             
             # Generate message
-            response = llm.invoke(prompt.format(
+            response = llm.invoke(FOLLOWUP_PROMPT.format(
                 message_history=formatted_history,
                 post_text=f"Follow-up for post: {post_url}"
             ))
@@ -106,26 +81,42 @@ class FollowupHandler:
     def add_followup(self, user_id: str, username: str, phone_number: str, 
                     post_url: str, followup_date: datetime, message: Optional[str] = None, 
                     last_message_date: Optional[datetime] = None) -> bool:
-        """Add a new follow-up entry to the Google Sheet"""
+        """Add a new follow-up entry to the Google Sheet
+
+        Without a message the row is written as a draft right away and the
+        message is composed in the background; finish_drafts fills it in.
+        """
         try:
-            # Compose message if not provided
-            if not message:
-                message = self.compose_followup_message(username, post_url, user_id)
-            
-            # Add follow-up using sheets handler
-            return self.sheets_handler.add_followup(
+            followup_id = self.sheets_handler.add_followup(
                 user_id=user_id,
                 username=username,
                 phone_number=phone_number,
                 post_url=post_url,
                 followup_date=followup_date,
                 message=message,
-                last_message_date=last_message_date
+                last_message_date=last_message_date,
+                status='pending' if message else 'draft'
             )
+            if followup_id and not message:
+                self.drafts[followup_id] = self.composer.submit(
+                    self.compose_followup_message, username, post_url, user_id
+                )
+            return bool(followup_id)
         except Exception as e:
             print(f"Error adding follow-up to Google Sheet: {str(e)}")
             return False
     
+    def finish_drafts(self) -> int:
+        """Wait for the drafts composed in the background and write them in one batch"""
+        drafts, self.drafts = self.drafts, {}
+        if not drafts:
+            return 0
+        print(f"Writing {len(drafts)} composed follow-up messages...")
+        messages = {followup_id: future.result() for followup_id, future in drafts.items()}
+        if not self.sheets_handler.fill_drafts(messages):
+            print("Failed to write follow-up drafts; they will be composed when due")
+        return len(messages)
+    
     def get_pending_followups(self) -> List[Dict]:
         """Get all pending follow-ups that were scheduled one day ago or more and user hasn't replied"""
         try:
@@ -158,12 +149,19 @@ class FollowupHandler:
             print(f"Error reading follow-ups: {str(e)}")
             return []
     
-    def process_followups(self) -> Dict[str, int]:
-        """Process all pending follow-ups and send messages"""
+    def process_followups(self) -> Optional[Dict[str, int]]:
+        """Send the follow-ups that are due and update their rows in one write
+
+        Returns None when the due follow-ups couldn't be read or processed.
+        """
         try:
-            # Get pending follow-ups
-            pending_followups = self.get_pending_followups()
-            print(f"Found {len(pending_followups)} pending follow-ups to process")
+            # Get due follow-ups from the queue, reading only their rows
+            pending_followups = self.sheets_handler.get_due_followups()
+            if pending_followups is None:
+                return None
+            print(f"Found {len(pending_followups)} due follow-ups to process")
+            completed = {}
+            messages = {}
             
             # Track results
             results = {
@@ -185,6 +183,11 @@ class FollowupHandler:
                     print(f"\nProcessing follow-up {followup_id} for user {username}")
                     print(f"Created at {created_at}, last message date: {last_message_date}")
                     
+                    # Compose drafts whose message was never filled in
+                    if followup['status'] == 'draft' or not message:
+                        message = self.compose_followup_message(username, followup['post_url'], user_id)
+                        messages[followup['row']] = message
+                    
                     message_sent = False
                     
                     # Try WhatsApp first if phone number is available
@@ -201,17 +204,23 @@ class FollowupHandler:
                     # Update follow-up status based on message success
                     if message_sent:
                         print(f"Message sent successfully for follow-up {followup_id}")
-                        self.mark_followup_completed(followup_id)
+                        completed[followup['row']] = 'completed'
+                        self.sheets_handler.scheduler.remove(followup_id)
                         results["successful"] += 1
                     else:
                         print(f"Failed to send message for follow-up {followup_id}")
+                        self.retry_later(followup_id)
                         results["failed"] += 1
                     
                 except Exception as e:
                     print(f"Error processing follow-up {followup['id']}: {str(e)}")
+                    self.retry_later(followup['id'])
                     results["failed"] += 1
                     continue
             
+            # Mark all sent follow-ups completed, with any messages composed here, in one write
+            self.sheets_handler.set_statuses(completed, messages=messages)
+            
             print(f"\nFinished processing follow-ups:")
             print(f"Total: {results['total']}")
             print(f"Successful: {results['successful']}")
@@ -221,7 +230,11 @@ class FollowupHandler:
             
         except Exception as e:
             print(f"Error processing follow-ups: {str(e)}")
-            return {"total": 0, "successful": 0, "failed": 0}
+            return None
+    
+    def retry_later(self, followup_id):
+        """Move a follow-up that couldn't be sent back in the queue"""
+        self.sheets_handler.scheduler.schedule(followup_id, datetime.now() + timedelta(hours=FOLLOWUP_RETRY_HOURS))
     
     def send_whatsapp_message(self, phone_number: str, message: str) -> bool:
         """Send WhatsApp message using whatsapp module"""
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FOLLOWUP_QUEUE_DB_FILE = "db/followups.db"
+
+class FollowupScheduler:
+    """Persistent priority queue of pending follow-ups keyed by due time
+
+    The follow-ups sheet stays the record people look at; this queue only knows
+    which follow-up is due next and which sheet row it was written to, so firing
+    due follow-ups never requires reading the rest of the sheet.
+    """
+
+    def __init__(self, path: str = FOLLOWUP_QUEUE_DB_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS queue (
+                    followup_id TEXT PRIMARY KEY,
+                    due_at REAL NOT NULL,
+                    row_number INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_queue_due_at ON queue (due_at);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def is_seeded(self) -> bool:
+        """Check whether the queue has been loaded from the sheet at least once"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'seeded_at'").fetchone()
+        return row is not None
+
+    def seed(self, entries: Iterable[Tuple[str, datetime, Optional[int]]]) -> None:
+        """Load (followup_id, due_at, row_number) entries read from the sheet and mark the queue seeded"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO queue (followup_id, due_at, row_number) VALUES (?, ?, ?)",
+                [(str(followup_id), due_at.timestamp(), row_number) for followup_id, due_at, row_number in entries]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded_at', ?)",
+                (datetime.now().isoformat(),)
+            )
+
+    def schedule(self, followup_id, due_at: datetime, row_number: Optional[int] = None) -> None:
+        """Add a follow-up or move it to a new due time"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO queue (followup_id, due_at, row_number) VALUES (?, ?, ?) "
+                "ON CONFLICT (followup_id) DO UPDATE SET due_at = excluded.due_at, "
+                "row_number = COALESCE(excluded.row_number, queue.row_number)",
+                (str(followup_id), due_at.timestamp(), row_number)
+            )
+
+    def due(self, now: Optional[datetime] = None) -> List[Dict]:
+        """Get the follow-ups due at `now`, earliest first"""
+        now = now or datetime.now()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT followup_id, due_at, row_number FROM queue WHERE due_at <= ? ORDER BY due_at",
+                (now.timestamp(),)
+            ).fetchall()
+        return [
+            {'followup_id': row[0], 'due_at': datetime.fromtimestamp(row[1]), 'row_number': row[2]}
+            for row in rows
+        ]
+
+    def next_due_at(self) -> Optional[datetime]:
+        """Get when the next follow-up falls due, or None if the queue is empty"""
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(due_at) FROM queue").fetchone()
+        return datetime.fromtimestamp(row[0]) if row[0] is not None else None
+
+    def get_row(self, followup_id) -> Optional[int]:
+        """Get the sheet row a queued follow-up was written to"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT row_number FROM queue WHERE followup_id = ?", (str(followup_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def update_row(self, followup_id, row_number: int) -> None:
+        """Record that a follow-up moved to another sheet row"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE queue SET row_number = ? WHERE followup_id = ?", (row_number, str(followup_id))
+            )
+
+    def remove(self, followup_id) -> None:
+        """Drop a follow-up that was sent, cancelled or deleted"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM queue WHERE followup_id = ?", (str(followup_id),))
@@ -4,11 +4,51 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 import os
+import pandas as pd
+from state_store import row_from_append_response
+from row_ids import RowIdAllocator, parse_id
+from followup_scheduler import FollowupScheduler
+from gspread.utils import rowcol_to_a1
 
 # Load environment variables
 load_dotenv()
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+HEADERS = [
+    'id', 'user_id', 'username', 'phone_number', 'post_url',
+    'followup_date', 'message', 'status', 'created_at',
+    'last_message_date', 'user_replied'
+]
+MESSAGE_COLUMN = 7
+STATUS_COLUMN = 8
+# Follow-ups still waiting to be sent; drafts are written before their message is composed
+OPEN_STATUSES = ['pending', 'draft']
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def followups_frame(values: List[List[str]]) -> pd.DataFrame:
+    """Build a typed frame from raw sheet values (row 0 is the header)
+
+    Dates are parsed column-wise and malformed ones become NaT instead of
+    failing the whole read; the sheet row of each record is kept in `row`.
+    """
+    header = values[0] if values else HEADERS
+    frame = pd.DataFrame(values[1:], columns=header)
+    frame['row'] = range(2, len(frame) + 2)
+    for column in ['followup_date', 'created_at']:
+        frame[column] = pd.to_datetime(frame[column], format=DATE_FORMAT, errors='coerce')
+    frame['user_replied'] = frame['user_replied'].str.strip().str.lower().eq('true')
+    frame['status'] = frame['status'].str.strip()
+    return frame
+
+def select_followups(frame: pd.DataFrame, today) -> Dict[str, pd.DataFrame]:
+    """Split a follow-ups frame into the pending rows that are due and the open replied rows to cancel"""
+    one_day_ago = pd.Timestamp(today - timedelta(days=1))
+    is_pending = frame['status'].eq('pending')
+    is_open = frame['status'].isin(OPEN_STATUSES)
+    return {
+        'pending': frame[is_pending & (frame['created_at'].dt.normalize() <= one_day_ago) & ~frame['user_replied']],
+        'cancelled': frame[is_open & frame['user_replied']]
+    }
 
 class FollowupSheetsHandler:
     def __init__(self, credentials_file="credentials.json"):
@@ -20,20 +60,22 @@ class FollowupSheetsHandler:
         # Ensure headers exist
         headers = self.worksheet.row_values(1)
         if not headers:
-            self.worksheet.append_row([
-                'id', 'user_id', 'username', 'phone_number', 'post_url',
-                'followup_date', 'message', 'status', 'created_at',
-                'last_message_date', 'user_replied'
-            ])
+            self.worksheet.append_row(HEADERS)
+        
+        # Row ids are allocated locally instead of scanning the sheet per insert
+        self.row_ids = RowIdAllocator(self.worksheet)
+        
+        # Local queue of pending follow-ups by due time, loaded from the sheet once
+        self.scheduler = FollowupScheduler()
+        if not self.scheduler.is_seeded():
+            self.seed_scheduler()
     
     def add_followup(self, user_id: str, username: str, phone_number: str, 
                     post_url: str, followup_date: datetime, message: Optional[str] = None, 
-                    last_message_date: Optional[datetime] = None) -> bool:
-        """Add a new follow-up entry to the Google Sheet"""
+                    last_message_date: Optional[datetime] = None, status: str = 'pending'):
+        """Add a new follow-up entry to the Google Sheet and return its id, or False on failure"""
         try:
-            # Get all records to determine new ID
-            all_records = self.worksheet.get_all_records()
-            new_id = 1 if not all_records else max(int(record['id']) for record in all_records) + 1
+            new_id = self.row_ids.allocate()
             
             # Handle None values and ensure proper data types
             phone_number = str(phone_number) if phone_number is not None else ""
@@ -49,58 +91,167 @@ class FollowupSheetsHandler:
                 str(post_url),
                 followup_date.strftime('%Y-%m-%d %H:%M:%S'),
                 message,
-                'pending',
+                status,
                 datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 last_message_date.strftime('%Y-%m-%d %H:%M:%S'),
                 'FALSE'  # user_replied as string for Google Sheets
             ]
             
-            # Append new row
-            self.worksheet.append_row(new_row)
-            return True
+            # Append new row and queue it for when it falls due
+            response = self.worksheet.append_row(new_row)
+            row_number = row_from_append_response(response)
+            new_id = self.row_ids.confirm(row_number, new_id)
+            self.scheduler.schedule(new_id, followup_date, row_number)
+            return new_id
         except Exception as e:
             print(f"Error adding follow-up to Google Sheet: {str(e)}")
             return False
     
+    def load_followups(self) -> pd.DataFrame:
+        """Read the whole sheet in one call into a typed frame"""
+        frame = followups_frame(self.worksheet.get_all_values())
+        malformed = int(frame['followup_date'].isna().sum() + frame['created_at'].isna().sum())
+        if malformed:
+            print(f"Warning: {malformed} malformed follow-up dates were skipped")
+        return frame
+    
     def get_pending_followups(self) -> List[Dict]:
         """Get all pending follow-ups that were scheduled one day ago or more and user hasn't replied"""
         try:
-            all_records = self.worksheet.get_all_records()
-            today = datetime.now().date()
-            one_day_ago = today - timedelta(days=1)
-            
-            # Convert string dates to datetime objects
-            for record in all_records:
-                record['followup_date'] = datetime.strptime(record['followup_date'], '%Y-%m-%d %H:%M:%S').date()
-                record['created_at'] = datetime.strptime(record['created_at'], '%Y-%m-%d %H:%M:%S').date()
-                record['user_replied'] = record['user_replied'].lower() == 'true'
+            selected = select_followups(self.load_followups(), datetime.now().date())
             
-            # Filter for pending follow-ups
-            pending = [
-                record for record in all_records
-                if (record['status'] == 'pending' and
-                    record['created_at'] <= one_day_ago and
-                    not record['user_replied'])
-            ]
-            
-            # Update status for replied follow-ups
-            for record in all_records:
-                if record['user_replied'] and record['status'] == 'pending':
-                    cell = self.worksheet.find(str(record['id']))
-                    if cell:
-                        self.worksheet.update_cell(cell.row, 8, 'cancelled')  # Update status column
+            # Cancel replied follow-ups in one write
+            cancelled_rows = selected['cancelled']['row'].tolist()
+            if cancelled_rows:
+                self.worksheet.batch_update([
+                    {'range': rowcol_to_a1(row, STATUS_COLUMN), 'values': [['cancelled']]}
+                    for row in cancelled_rows
+                ], raw=False)
             
-            return pending
+            pending = selected['pending'].drop(columns='row')
+            pending['followup_date'] = pending['followup_date'].dt.date
+            pending['created_at'] = pending['created_at'].dt.date
+            return pending.to_dict('records')
         except Exception as e:
             print(f"Error processing follow-ups: {str(e)}")
             return []
     
+    def seed_scheduler(self):
+        """Queue every pending follow-up in the sheet by its follow-up date"""
+        try:
+            frame = self.load_followups()
+            pending = frame[frame['status'].isin(OPEN_STATUSES) & ~frame['user_replied'] & frame['followup_date'].notna()]
+            self.scheduler.seed(
+                (followup_id, followup_date.to_pydatetime(), row)
+                for followup_id, followup_date, row in zip(pending['id'], pending['followup_date'], pending['row'])
+            )
+            print(f"Queued {len(pending)} pending follow-ups from the sheet")
+            return True
+        except Exception as e:
+            print(f"Error seeding follow-up queue from Google Sheet: {str(e)}")
+            return False
+    
+    def read_rows(self, rows: List[int]) -> List[Optional[Dict]]:
+        """Read only the given sheet rows in one call; rows past the end come back as None"""
+        ranges = self.worksheet.batch_get([
+            f"{rowcol_to_a1(row, 1)}:{rowcol_to_a1(row, len(HEADERS))}" for row in rows
+        ])
+        records = []
+        for values in ranges:
+            if not values or not values[0]:
+                records.append(None)
+                continue
+            record = dict(zip(HEADERS, values[0] + [''] * (len(HEADERS) - len(values[0]))))
+            record['user_replied'] = record['user_replied'].strip().lower() == 'true'
+            records.append(record)
+        return records
+    
+    def set_statuses(self, statuses: Dict[int, str], messages: Optional[Dict[int, str]] = None) -> bool:
+        """Write the status, and optionally the message, of several rows in one batch_update"""
+        messages = messages or {}
+        if not statuses and not messages:
+            return True
+        try:
+            self.worksheet.batch_update([
+                {'range': rowcol_to_a1(row, STATUS_COLUMN), 'values': [[status]]}
+                for row, status in statuses.items()
+            ] + [
+                {'range': rowcol_to_a1(row, MESSAGE_COLUMN), 'values': [[message]]}
+                for row, message in messages.items()
+            ], raw=False)
+            return True
+        except Exception as e:
+            print(f"Error updating follow-up statuses: {str(e)}")
+            return False
+    
+    def fill_drafts(self, messages: Dict) -> bool:
+        """Write composed messages into draft rows and mark them pending, in one batch_update"""
+        rows = {}
+        for followup_id, message in messages.items():
+            row = self.scheduler.get_row(followup_id)
+            if row is None:
+                print(f"No queued row for draft follow-up {followup_id}, it will be composed when due")
+                continue
+            rows[row] = message
+        return self.set_statuses({row: 'pending' for row in rows}, messages=rows)
+    
+    def get_due_followups(self, now: Optional[datetime] = None) -> Optional[List[Dict]]:
+        """Get the queued follow-ups that are due, reading only their rows
+
+        Each row's id is checked against the queue entry; entries whose rows
+        moved are found again with one read of the id column. Follow-ups that
+        are no longer pending leave the queue, and replied ones are cancelled.
+        Returns None if the sheet couldn't be read.
+        """
+        try:
+            due = self.scheduler.due(now)
+            if not due:
+                return []
+            
+            records = self.read_rows([entry['row_number'] or 2 for entry in due])
+            moved = [
+                i for i, (entry, record) in enumerate(zip(due, records))
+                if record is None or parse_id(record['id']) != parse_id(entry['followup_id'])
+            ]
+            if moved:
+                # Rows shift when follow-ups are deleted; relocate them by id
+                id_rows = {
+                    parse_id(value): row for row, value in enumerate(self.worksheet.col_values(1)[1:], start=2)
+                }
+                for i in moved:
+                    due[i]['row_number'] = id_rows.get(parse_id(due[i]['followup_id']))
+                    records[i] = None
+                found = [i for i in moved if due[i]['row_number']]
+                if found:
+                    for i, record in zip(found, self.read_rows([due[i]['row_number'] for i in found])):
+                        records[i] = record
+                        self.scheduler.update_row(due[i]['followup_id'], due[i]['row_number'])
+            
+            due_followups = []
+            cancelled = {}
+            for entry, record in zip(due, records):
+                if record is None or record['status'] not in OPEN_STATUSES:
+                    # Deleted, or completed or cancelled outside the queue
+                    self.scheduler.remove(entry['followup_id'])
+                elif record['user_replied']:
+                    cancelled[entry['row_number']] = 'cancelled'
+                    self.scheduler.remove(entry['followup_id'])
+                else:
+                    record['row'] = entry['row_number']
+                    due_followups.append(record)
+            self.set_statuses(cancelled)
+            return due_followups
+        except Exception as e:
+            print(f"Error reading due follow-ups: {str(e)}")
+            return None
+    
     def mark_followup_completed(self, followup_id: int) -> bool:
         """Mark a follow-up as completed"""
         try:
             cell = self.worksheet.find(str(followup_id))
             if cell:
                 self.worksheet.update_cell(cell.row, 8, 'completed')  # Update status column
+                self.scheduler.remove(followup_id)
                 return True
             return False
         except Exception as e:
@@ -113,6 +264,7 @@ class FollowupSheetsHandler:
             cell = self.worksheet.find(str(followup_id))
             if cell:
                 self.worksheet.delete_row(cell.row)
+                self.scheduler.remove(followup_id)
                 return True
             return False
         except Exception as e:
@@ -122,12 +274,7 @@ class FollowupSheetsHandler:
     def get_all_followups(self) -> List[Dict]:
         """Get all follow-ups with their creation timestamps"""
         try:
-            all_records = self.worksheet.get_all_records()
-            # Convert string dates to datetime objects
-            for record in all_records:
-                record['created_at'] = datetime.strptime(record['created_at'], '%Y-%m-%d %H:%M:%S')
-                record['followup_date'] = datetime.strptime(record['followup_date'], '%Y-%m-%d %H:%M:%S')
-            return all_records
+            return self.load_followups().drop(columns='row').to_dict('records')
         except Exception as e:
             print(f"Error reading follow-ups: {str(e)}")
-            return [] 
\ No newline at end of file
+            return []
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+CACHE_DB_FILE = "db/llm_cache.db"
+CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+
+def normalize_text(text: str) -> str:
+    """Normalize post text so trivially reformatted copies share a cache key"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+class LLMCache:
+    """Disk-backed cache of LLM results keyed on post content and model/prompt version"""
+
+    def __init__(self, version: str, path: str = CACHE_DB_FILE,
+                 ttl_days: float = CACHE_TTL_DAYS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.version = version
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache (last_access);
+            """)
+
+    def make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.version}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[Dict[str, Any]]:
+        """Get the cached result for a post, or None on a miss"""
+        key = self.make_key(text)
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, text: str, value: Dict[str, Any]) -> None:
+        """Store a result and evict the least recently used entries beyond the size limit"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (self.make_key(text), json.dumps(value, ensure_ascii=False), now, now)
+            )
+            excess = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+
+    def purge_expired(self) -> int:
+        """Delete entries older than the TTL and return how many were removed"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,33 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from langchain_groq import ChatGroq
+from dotenv import load_dotenv
+from rate_limiter import get_groq_http_client, get_groq_async_http_client
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_MODEL = "mixtral-8x7b-32768"
+
+_llms: Dict[Tuple[str, float], ChatGroq] = {}
+_lock = threading.Lock()
+
+def get_llm(temperature: float, model_name: Optional[str] = None) -> ChatGroq:
+    """Get the shared Groq client for a model and temperature
+
+    All clients share the rate-limited, keep-alive HTTP clients, so repeated
+    calls reuse pooled connections instead of paying a new TLS handshake.
+    """
+    model_name = model_name or os.getenv("GROQ_MODEL", DEFAULT_MODEL)
+    key = (model_name, temperature)
+    with _lock:
+        if key not in _llms:
+            _llms[key] = ChatGroq(
+                model_name=model_name,
+                temperature=temperature,
+                api_key=os.getenv("GROQ_API_KEY"),
+                http_client=get_groq_http_client(),
+                http_async_client=get_groq_async_http_client()
+            )
+        return _llms[key]
@@ -0,0 +1,112 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+MESSAGE_HISTORY_DB_FILE = "db/history.db"
+# Per-user JSON files the history used to be kept in, migrated once
+LEGACY_HISTORY_DIR = "db/history"
+
+class MessageHistory:
+    """Append-only log of the messages sent to each user
+
+    Messages are only ever inserted, and the (user_id, id) index lets the last
+    few messages of a user be read without touching older entries.
+    """
+
+    def __init__(self, path: str = MESSAGE_HISTORY_DB_FILE, legacy_dir: str = LEGACY_HISTORY_DIR):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    platform TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+        if not self.is_migrated():
+            self.migrate(legacy_dir)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def is_migrated(self) -> bool:
+        """Check whether the legacy JSON history files have been imported"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_at'").fetchone()
+        return row is not None
+
+    def migrate(self, legacy_dir: str = LEGACY_HISTORY_DIR) -> int:
+        """Import the per-user JSON history files once, in one transaction"""
+        entries = []
+        if os.path.isdir(legacy_dir):
+            for name in sorted(os.listdir(legacy_dir)):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(legacy_dir, name), 'r', encoding='utf-8') as f:
+                        history = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable history file {name}: {str(e)}")
+                    continue
+                user_id = name[:-len('.json')]
+                entries.extend(
+                    (user_id, entry.get('timestamp', ''), entry.get('message', ''), entry.get('platform'))
+                    for entry in history if isinstance(entry, dict)
+                )
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO messages (user_id, timestamp, message, platform) VALUES (?, ?, ?, ?)",
+                entries
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_at', ?)",
+                (datetime.now().isoformat(),)
+            )
+        if entries:
+            print(f"Migrated {len(entries)} messages from {legacy_dir} into the history store")
+        return len(entries)
+
+    def append(self, user_id, message: str, platform: Optional[str] = None) -> None:
+        """Record a message sent to a user"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO messages (user_id, timestamp, message, platform) VALUES (?, ?, ?, ?)",
+                (str(user_id), datetime.now().isoformat(), message, platform)
+            )
+
+    def last_n(self, user_id, n: int = 3) -> List[Dict]:
+        """Get a user's last `n` messages, oldest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT timestamp, message, platform FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (str(user_id), n)
+            ).fetchall()
+        return [
+            {'timestamp': row[0], 'message': row[1], 'platform': row[2]}
+            for row in reversed(rows)
+        ]
+
+_history: Optional[MessageHistory] = None
+_lock = threading.Lock()
+
+def get_message_history_store() -> MessageHistory:
+    """Get the shared message history store, opening (and migrating) it on first use"""
+    global _history
+    with _lock:
+        if _history is None:
+            _history = MessageHistory()
+        return _history
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from phone_numbers import NON_DIGITS_PATTERN, find_phone_numbers
+
+NEAR_DUP_DB_FILE = "db/near_duplicates.db"
+# Posts whose 64-bit SimHashes differ in at most this many bits are near-duplicates
+MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "4"))
+
+HASH_BITS = 64
+HASHTAG_PATTERN = re.compile(r"#\w+", re.UNICODE)
+SEPARATED_DIGITS_PATTERN = re.compile(r"(?<=\d)[\s\-.()]+(?=\d)")
+LONG_NUMBER_PATTERN = re.compile(r"\d{9,}")
+TOKEN_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+
+def normalize_for_simhash(text: str) -> List[str]:
+    """Tokenize a post, ignoring case, punctuation, emoji, hashtags and phone number formatting"""
+    text = HASHTAG_PATTERN.sub(" ", text.lower())
+    text = SEPARATED_DIGITS_PATTERN.sub("", text)
+    # Compare phone numbers on their last 9 digits so +971 50... and 050... match
+    text = LONG_NUMBER_PATTERN.sub(lambda match: match.group()[-9:], text)
+    return TOKEN_PATTERN.findall(text)
+
+def contact_numbers(text: str) -> List[str]:
+    """Get the phone numbers in a post, with unresolved digit runs kept as bare digits"""
+    numbers, unresolved = find_phone_numbers(text)
+    return sorted(set(numbers) | {NON_DIGITS_PATTERN.sub("", raw) for raw in unresolved})
+
+def same_contact(a: List[str], b: Optional[List[str]]) -> bool:
+    """Check whether two posts can be from the same advertiser: their numbers overlap or neither has any"""
+    if b is None:
+        # Indexed before numbers were stored, so it can't be compared
+        return False
+    return bool(set(a) & set(b)) if a or b else True
+
+def simhash(text: str) -> int:
+    """Compute a 64-bit SimHash over word bigram shingles"""
+    tokens = normalize_for_simhash(text)
+    shingles = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] or tokens
+    weights = [0] * HASH_BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(HASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(HASH_BITS) if weights[bit] > 0)
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def to_signed(value: int) -> int:
+    """Store unsigned 64-bit hashes in SQLite's signed INTEGER"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+class NearDuplicateIndex:
+    """Persisted SimHash index of decided posts
+
+    Hashes are split into MAX_DISTANCE + 1 bands, so any two hashes within
+    MAX_DISTANCE bits share at least one identical band and can be found with
+    an indexed lookup instead of a scan. Ads posted from a shared template
+    differ mostly in their phone numbers, so close hashes only count as
+    duplicates when the posts' numbers overlap.
+    """
+
+    def __init__(self, path: str = NEAR_DUP_DB_FILE, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = HASH_BITS // self.bands
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS posts (
+                    post_id TEXT PRIMARY KEY,
+                    simhash INTEGER NOT NULL,
+                    duplicate_of TEXT,
+                    decision TEXT,
+                    created_at REAL NOT NULL,
+                    phone_numbers TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_posts_duplicate_of ON posts (duplicate_of);
+                CREATE TABLE IF NOT EXISTS bands (
+                    band INTEGER NOT NULL,
+                    value INTEGER NOT NULL,
+                    post_id TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_bands_lookup ON bands (band, value);
+                CREATE INDEX IF NOT EXISTS idx_bands_post_id ON bands (post_id);
+            """)
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(posts)")]
+            if "phone_numbers" not in columns:
+                self.conn.execute("ALTER TABLE posts ADD COLUMN phone_numbers TEXT")
+
+    def _bands(self, value: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (band * self.band_bits)) & mask for band in range(self.bands)]
+
+    def __contains__(self, post_id) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM posts WHERE post_id = ?", (str(post_id),)).fetchone()
+        return row is not None
+
+    def find(self, text: str, exclude_post_id=None) -> Optional[Dict[str, Any]]:
+        """Find the closest indexed original post within MAX_DISTANCE of the text with the same phone numbers"""
+        value = simhash(text)
+        numbers = contact_numbers(text)
+        best = None
+        with self.lock:
+            candidates = set()
+            for band, band_value in enumerate(self._bands(value)):
+                candidates.update(
+                    row[0] for row in self.conn.execute(
+                        "SELECT post_id FROM bands WHERE band = ? AND value = ?", (band, band_value)
+                    )
+                )
+            candidates.discard(str(exclude_post_id))
+            for post_id in candidates:
+                row = self.conn.execute(
+                    "SELECT simhash, duplicate_of, decision, phone_numbers FROM posts WHERE post_id = ?", (post_id,)
+                ).fetchone()
+                if row is None or not same_contact(numbers, json.loads(row[3]) if row[3] else None):
+                    continue
+                distance = hamming_distance(value, row[0] & ((1 << 64) - 1))
+                if distance <= self.max_distance and (best is None or distance < best["distance"]):
+                    best = {
+                        # Always link to the first post of a duplicate chain
+                        "post_id": row[1] or post_id,
+                        "decision": json.loads(row[2]) if row[2] else None,
+                        "distance": distance
+                    }
+        return best
+
+    def add(self, post_id, text: str, decision: Optional[Dict[str, Any]] = None,
+            duplicate_of: Optional[str] = None) -> None:
+        """Index a post; the decision can be filled in later with set_decision"""
+        post_id = str(post_id)
+        value = simhash(text)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO posts (post_id, simhash, duplicate_of, decision, created_at, phone_numbers) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (post_id, to_signed(value), duplicate_of, json.dumps(decision) if decision else None, time.time(),
+                 json.dumps(contact_numbers(text)))
+            )
+            self.conn.execute("DELETE FROM bands WHERE post_id = ?", (post_id,))
+            # Duplicates are reachable through their original, so only originals are banded
+            if duplicate_of is None:
+                self.conn.executemany(
+                    "INSERT INTO bands (band, value, post_id) VALUES (?, ?, ?)",
+                    [(band, band_value, post_id) for band, band_value in enumerate(self._bands(value))]
+                )
+
+    def set_decision(self, post_id, decision: Dict[str, Any]) -> None:
+        """Record the decision for a post and the duplicates linked to it"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE posts SET decision = ? WHERE post_id = ? OR duplicate_of = ?",
+                (json.dumps(decision), str(post_id), str(post_id))
+            )
+
+    def remove(self, post_id) -> None:
+        """Forget a post and its linked duplicates, e.g. when its decision failed"""
+        post_id = str(post_id)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM bands WHERE post_id IN (SELECT post_id FROM posts WHERE post_id = ? OR duplicate_of = ?)",
+                (post_id, post_id)
+            )
+            self.conn.execute("DELETE FROM posts WHERE post_id = ? OR duplicate_of = ?", (post_id, post_id))
+
+    def remove_pending(self) -> int:
+        """Forget originals left without a decision by an interrupted run, with their duplicates"""
+        with self.lock:
+            pending = [row[0] for row in self.conn.execute(
+                "SELECT post_id FROM posts WHERE decision IS NULL AND duplicate_of IS NULL"
+            )]
+        for post_id in pending:
+            self.remove(post_id)
+        return len(pending)
@@ -0,0 +1,74 @@
+import os
+import re
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Country code assumed for numbers written in national form, e.g. 050 123 4567
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "971")
+# Length of a national number without its trunk 0 in the default country
+NATIONAL_NUMBER_LENGTH = int(os.getenv("NATIONAL_NUMBER_LENGTH", "9"))
+
+# One pass over the text: dates and ranges such as salaries are matched first so
+# their digits are never taken for phone numbers, then any run of 7+ digits with
+# the usual separators
+PHONE_PATTERN = re.compile(r"""
+    (?P<date>(?<!\d)\d{1,4}[/.\-]\d{1,2}[/.\-]\d{1,4}(?!\d))
+    |
+    (?P<range>(?<![\d\-.])\d{3,5}\s?-\s?\d{3,5}(?![\d\-.]|\s\d))
+    |
+    (?P<phone>(?<![\w+])(?:\+|00)?\(?\d(?:[\s\-.()]{0,2}\d){6,15}(?!\d))
+""", re.VERBOSE)
+NON_DIGITS_PATTERN = re.compile(r"\D")
+
+def normalize_phone_number(raw: str, country_code: str = DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """Get a number in +<country code><number> form, or None if it can't be resolved"""
+    raw = raw.strip()
+    digits = NON_DIGITS_PATTERN.sub("", raw)
+    if raw.startswith("+"):
+        international = digits
+    elif digits.startswith("00"):
+        international = digits[2:]
+    elif digits.startswith(country_code) and len(digits) == len(country_code) + NATIONAL_NUMBER_LENGTH:
+        international = digits
+    elif digits.startswith("0") and len(digits) == NATIONAL_NUMBER_LENGTH + 1:
+        # National form with trunk prefix
+        international = country_code + digits[1:]
+    elif len(digits) == NATIONAL_NUMBER_LENGTH and not digits.startswith("0"):
+        international = country_code + digits
+    else:
+        return None
+    if not 8 <= len(international) <= 15 or international.startswith("0"):
+        return None
+    return "+" + international
+
+def find_phone_numbers(text: str, country_code: str = DEFAULT_COUNTRY_CODE) -> Tuple[List[str], List[str]]:
+    """Get the deduplicated phone numbers in a text and the digit runs that couldn't be resolved"""
+    numbers = []
+    unresolved = []
+    for match in PHONE_PATTERN.finditer(text or ""):
+        raw = match.group("phone")
+        if raw is None:
+            continue
+        number = normalize_phone_number(raw, country_code)
+        if number is None:
+            unresolved.append(raw.strip())
+        elif number not in numbers:
+            numbers.append(number)
+    return numbers, unresolved
+
+def extract_phone_numbers(text: str, country_code: str = DEFAULT_COUNTRY_CODE) -> List[str]:
+    """Get the deduplicated phone numbers in a text, in the order they appear"""
+    return find_phone_numbers(text, country_code)[0]
+
+def format_phone_number(phone, country_code: str = DEFAULT_COUNTRY_CODE) -> str:
+    """Format a stored or LLM-extracted number for WhatsApp"""
+    # Sheets can hand numbers back as floats
+    phone = str(int(phone)) if isinstance(phone, float) else str(phone)
+    number = normalize_phone_number(phone, country_code)
+    if number:
+        return number
+    # Keep whatever was given rather than dropping the contact
+    return "+" + NON_DIGITS_PATTERN.sub("", phone)
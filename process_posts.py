@@ -1,18 +1,23 @@
+import asyncio
 import json
-import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import argparse
 from typing import List, Dict, Any
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from langchain.schema.runnable import RunnablePassthrough
 import os
 import sys
 from dotenv import load_dotenv
 from sheets_handler import SheetsHandler
+from llm_clients import get_llm
+from spam_classifier import load_preclassifier, record_decision
+from llm_cache import LLMCache
+from near_duplicates import NearDuplicateIndex
+from watermarks import WatermarkStore
+from phone_numbers import find_phone_numbers, format_phone_number
 
 # Set console encoding to UTF-8 for Windows
 if sys.platform == 'win32':
@@ -22,6 +27,18 @@ if sys.platform == 'win32':
 # Load environment variables
 load_dotenv()
 
+SCRAPED_DATA_FILE = "facebook_scraped_data.ndjson"
+# Concurrent workers per pipeline stage and the posts allowed to wait between stages
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "20"))
+QUEUE_SAMPLE_SECS = 0.5
+PROGRESS_INTERVAL_SECS = float(os.getenv("PROGRESS_INTERVAL_SECS", "10"))
+# Bump when the prompts or output models change so cached LLM results are not reused
+PROMPT_VERSION = "1"
+# Classify and extract phone numbers in one LLM call instead of two
+COMBINED_ANALYSIS = os.getenv("COMBINED_ANALYSIS", "true").lower() == "true"
+
 class PostClassification(BaseModel):
     category: str = Field(description="The category of the post: 'job' or 'spam'")
     confidence: float = Field(description="Confidence score between 0 and 1")
@@ -31,13 +48,25 @@ class PhoneNumberExtraction(BaseModel):
     phone_numbers: List[str] = Field(description="List of WhatsApp numbers found in the text")
     confidence: float = Field(description="Confidence score between 0 and 1")
 
+class PostAnalysis(BaseModel):
+    category: str = Field(description="The category of the post: 'job' or 'spam'")
+    confidence: float = Field(description="Confidence score between 0 and 1")
+    reasoning: str = Field(description="Brief explanation for the classification")
+    phone_numbers: List[str] = Field(description="List of WhatsApp numbers found in the text, empty for spam posts")
+
+# Chains are built once per process and reused across runs
+_chains = None
+
 def setup_langchain():
-    # Initialize Groq model
-    llm = ChatGroq(
-        model_name=os.getenv("GROQ_MODEL", "mixtral-8x7b-32768"),
-        temperature=float(os.getenv("TEMPERATURE", "0")),
-        api_key=os.getenv("GROQ_API_KEY")
-    )
+    """Get the classification, phone extraction and combined analysis chains"""
+    global _chains
+    if _chains is None:
+        _chains = build_chains()
+    return _chains
+
+def build_chains():
+    # Get the shared Groq model
+    llm = get_llm(float(os.getenv("TEMPERATURE", "0")))
     
     # Create output parser for post classification
     classification_parser = PydanticOutputParser(pydantic_object=PostClassification)
@@ -45,6 +74,9 @@ def setup_langchain():
     # Create output parser for phone number extraction
     phone_parser = PydanticOutputParser(pydantic_object=PhoneNumberExtraction)
     
+    # Create output parser for combined classification and extraction
+    analysis_parser = PydanticOutputParser(pydantic_object=PostAnalysis)
+    
     # Create prompt template for post classification
     classification_prompt = ChatPromptTemplate.from_messages([
         ("system", """You are an expert at classifying social media posts, specifically focused on job postings and spam detection.
@@ -90,188 +122,510 @@ def setup_langchain():
         ("human", "Text: {text}")
     ])
     
-    # Create chains
+    # Create prompt template for combined classification and phone number extraction
+    analysis_prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are an expert at classifying social media posts, specifically focused on job postings and spam detection, and at extracting WhatsApp numbers from them.
+        
+        First, determine if the post is a legitimate job posting or spam.
+        
+        For legitimate job posts, look for:
+        - Clear job description and requirements
+        - Specific role or position mentioned
+        - Professional tone and language
+        - Contact information (phone, email, etc.)
+        - Salary/compensation details (if mentioned)
+        - Location or work arrangement details
+        
+        For spam posts, look for:
+        - Promotional content without job details
+        - Suspicious links or URLs
+        - Get-rich-quick schemes
+        - MLM or pyramid scheme indicators
+        - Vague or overly generic job descriptions
+        - Excessive use of emojis or clickbait language
+        
+        Then, if the post is a job post, identify all valid WhatsApp numbers in it:
+        - Numbers may be in various formats (e.g., +1234567890, 1234567890, 123-456-7890)
+        - Numbers should be 10-12 digits long (excluding country code)
+        - Always include the country code if present
+        - Format all numbers with a '+' prefix
+        - Remove any spaces, dashes, or other separators
+        - Return an empty list for spam posts
+        
+        Provide your classification with a confidence score and brief reasoning.
+        
+        {format_instructions}"""),
+        ("human", "Post text: {text}")
+    ])
+    
+    # Create chains with the format instructions rendered into the prompts up front
     classification_chain = (
-        RunnablePassthrough.assign(
-            format_instructions=lambda _: classification_parser.get_format_instructions()
-        )
-        | classification_prompt
+        classification_prompt.partial(format_instructions=classification_parser.get_format_instructions())
         | llm
         | classification_parser
     )
     
     phone_chain = (
-        RunnablePassthrough.assign(
-            format_instructions=lambda _: phone_parser.get_format_instructions()
-        )
-        | phone_prompt
+        phone_prompt.partial(format_instructions=phone_parser.get_format_instructions())
         | llm
         | phone_parser
     )
     
-    return classification_chain, phone_chain
+    analysis_chain = (
+        analysis_prompt.partial(format_instructions=analysis_parser.get_format_instructions())
+        | llm
+        | analysis_parser
+    )
+    
+    return classification_chain, phone_chain, analysis_chain
 
-def format_phone_number(phone: str) -> str:
-    # Remove spaces and keep existing + if present
-    if phone.startswith('+'):
-        return '+' + re.sub(r'\s+', '', phone[1:])
-    return '+' + re.sub(r'\s+', '', phone)
+def iter_scraped_posts(path: str = SCRAPED_DATA_FILE):
+    """Yield scraped posts one record at a time from an NDJSON file"""
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
 
 def get_processed_posts(sheets_handler):
-    """Get all post IDs that have been processed"""
-    posts = sheets_handler.get_all_posts()
-    return {post['post_id'] for post in posts}
+    """Get the local index of processed post IDs"""
+    return sheets_handler.state_store
+
+def save_unprocessed_posts(posts, path: str = SCRAPED_DATA_FILE):
+    """Replace the scraped file with the posts still to be processed, or remove it if there are none"""
+    if not posts:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        for post in posts:
+            file.write(json.dumps(post, ensure_ascii=False, separators=(',', ':')))
+            file.write('\n')
+    os.replace(tmp_path, path)
+
+def commit_watermarks():
+    """Advance the group watermarks staged by the scrape now that its posts are stored"""
+    advanced = WatermarkStore().commit()
+    if advanced:
+        print(f"Advanced watermarks for {advanced} groups")
+
+def analysis_to_dict(result, phone_numbers: List[str]) -> Dict[str, Any]:
+    """Get the stored form of a post decision"""
+    return {
+        "category": result.category,
+        "confidence": result.confidence,
+        "reasoning": result.reasoning,
+        "phone_numbers": phone_numbers
+    }
+
+def print_post_header(action: str, index: int, total_posts: int, post: Dict[str, Any]):
+    user = post.get("user") or {}
+    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] {action} {index}/{total_posts}")
+    print(f"User: {user.get('name', 'Unknown')} (ID: {user.get('id', 'N/A')})")
+    print(f"Post ID: {post.get('id', 'N/A')}")
 
-def process_posts(reprocess_all: bool = False):
+class PostPipeline:
+    """Staged post processing: load -> classify -> extract -> persist
+
+    Stages are connected by bounded asyncio queues, so a slow stage pauses the
+    ones before it instead of letting posts pile up in memory. Blocking LLM and
+    Sheets calls run in worker threads so their network waits overlap, and
+    posts are persisted in the order they were read.
+    """
+
+    def __init__(self, posts, total_posts: int, chains, combined: bool, llm_cache, near_duplicates,
+                 preclassifier, sheets_handler, classify_concurrency: int = LLM_CONCURRENCY,
+                 extract_concurrency: int = EXTRACT_CONCURRENCY, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.posts = posts
+        self.total_posts = total_posts
+        self.classification_chain, self.phone_chain, self.analysis_chain = chains
+        self.combined = combined
+        self.llm_cache = llm_cache
+        self.near_duplicates = near_duplicates
+        self.preclassifier = preclassifier
+        self.sheets_handler = sheets_handler
+        self.classify_concurrency = classify_concurrency
+        self.extract_concurrency = extract_concurrency
+        self.queue_size = queue_size
+        self.stats = dict.fromkeys([
+            "processed", "job", "spam", "skipped", "failed", "duplicate", "local_decisions", "local_phone"
+        ], 0)
+        self.queue_depths = {}
+        # Decisions of stored posts whose rows are still in the Sheets buffer
+        self.unflushed = {}
+        # Posts that couldn't be decided or stored, kept to be retried
+        self.failed_posts = []
+        self.start_time = time.time()
+
+    async def run(self):
+        self.start_time = time.time()
+        self.classify_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.extract_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.persist_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.queues = {"classify": self.classify_queue, "extract": self.extract_queue, "persist": self.persist_queue}
+        self.queue_depths = {name: {"max": 0, "total": 0, "samples": 0} for name in self.queues}
+        # Every post holds a slot from loading until it is persisted, which also
+        # bounds the reorder buffer in front of persistence
+        self.in_flight = asyncio.Semaphore(3 * self.queue_size + self.classify_concurrency + self.extract_concurrency)
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.classify_concurrency + self.extract_concurrency + 1)
+        )
+
+        classifiers = [asyncio.create_task(self.classify_worker()) for _ in range(self.classify_concurrency)]
+        extractors = [asyncio.create_task(self.extract_worker()) for _ in range(self.extract_concurrency)]
+        persister = asyncio.create_task(self.persist_worker())
+        monitor = asyncio.create_task(self.monitor())
+        try:
+            await self.load()
+            for _ in classifiers:
+                await self.classify_queue.put(None)
+            await asyncio.gather(*classifiers)
+            for _ in extractors:
+                await self.extract_queue.put(None)
+            await asyncio.gather(*extractors)
+            await self.persist_queue.put(None)
+            await persister
+        finally:
+            for task in classifiers + extractors + [persister, monitor]:
+                task.cancel()
+
+    async def load(self):
+        """Validate posts in read order and queue the ones that need a decision"""
+        seq = 0
+        for position, post in enumerate(self.posts, start=1):
+            # Let the other stages run between posts that are skipped without queueing
+            await asyncio.sleep(0)
+            post["text"] = (post.get("text") or "").strip()
+            if not post["text"]:
+                print_post_header("Skipping post", position, self.total_posts, post)
+                print("Error: Post text is empty or None")
+                self.stats["skipped"] += 1
+                self.stats["processed"] += 1
+            elif self.sheets_handler.has_post(post.get("id", "N/A")):
+                print_post_header("Skipping already processed post", position, self.total_posts, post)
+                print("Post already exists in database, skipping...")
+                self.stats["skipped"] += 1
+                self.stats["processed"] += 1
+            elif (duplicate := self.near_duplicates.find(post["text"], exclude_post_id=post.get("id", "N/A"))) is not None:
+                # Reuse the original's decision so the advertiser isn't messaged again
+                print_post_header("Skipping near-duplicate post", position, self.total_posts, post)
+                decision = duplicate["decision"] or {}
+                print(f"Near-duplicate of post {duplicate['post_id']} (distance {duplicate['distance']}, "
+                      f"decision: {decision.get('category', 'pending')}), skipping...")
+                self.near_duplicates.add(post.get("id", "N/A"), post["text"], decision=duplicate["decision"],
+                                         duplicate_of=duplicate["post_id"])
+                self.stats["duplicate"] += 1
+                self.stats["processed"] += 1
+            else:
+                # Index the post right away so later copies link to it
+                self.near_duplicates.add(post.get("id", "N/A"), post["text"])
+                await self.in_flight.acquire()
+                await self.classify_queue.put({
+                    "seq": seq,
+                    "position": position,
+                    "post": post,
+                    "result": None,
+                    "phone_result": None,
+                    "cacheable": False
+                })
+                seq += 1
+
+    async def classify_worker(self):
+        while (item := await self.classify_queue.get()) is not None:
+            try:
+                await self.classify(item)
+            except Exception as e:
+                item["result"] = e
+            await self.extract_queue.put(item)
+
+    async def classify(self, item):
+        """Classify a post from the cache, the local pre-classifier or the LLM"""
+        post = item["post"]
+        # Reuse cached results for posts whose content was already analysed
+        cached = self.llm_cache.get(post["text"])
+        if cached:
+            item["result"] = PostAnalysis(**cached)
+            return
+
+        # Decide obvious posts locally so only the uncertain ones reach the LLM
+        if self.preclassifier:
+            local_result = self.preclassifier.classify(post["text"])
+            if local_result:
+                category, confidence = local_result
+                item["result"] = PostClassification(
+                    category=category,
+                    confidence=confidence,
+                    reasoning="Decided by the local pre-classifier"
+                )
+                self.stats["local_decisions"] += 1
+                return
+
+        # In combined mode the same call also extracts the phone numbers
+        chain = self.analysis_chain if self.combined else self.classification_chain
+        item["result"] = await asyncio.to_thread(chain.invoke, {"text": post["text"]})
+        # Only fresh LLM results are written to the cache
+        item["cacheable"] = True
+        # Keep LLM decisions as training data for the pre-classifier
+        record_decision(post.get("id", "N/A"), post["text"], item["result"].category, item["result"].confidence)
+
+    async def extract_worker(self):
+        while (item := await self.extract_queue.get()) is not None:
+            try:
+                await self.extract(item)
+            except Exception as e:
+                item["phone_result"] = e
+            await self.persist_queue.put(item)
+
+    async def extract(self, item):
+        """Extract phone numbers from a job post, using the LLM only for digit runs the pattern can't resolve"""
+        result = item["result"]
+        if isinstance(result, Exception) or result.category == 'spam':
+            return
+        text = item["post"]["text"]
+        numbers, unresolved = find_phone_numbers(text)
+        if not unresolved:
+            item["phone_result"] = PhoneNumberExtraction(phone_numbers=numbers, confidence=1.0)
+            self.stats["local_phone"] += 1
+        elif isinstance(result, PostAnalysis):
+            item["phone_result"] = result
+        else:
+            item["phone_result"] = await asyncio.to_thread(self.phone_chain.invoke, {"text": text})
+
+    async def persist_worker(self):
+        """Store posts in read order, holding back posts that finished early"""
+        pending = {}
+        next_seq = 0
+        while (item := await self.persist_queue.get()) is not None:
+            pending[item["seq"]] = item
+            while next_seq in pending:
+                item = pending.pop(next_seq)
+                try:
+                    await self.store(item)
+                except Exception as e:
+                    print(f"Error storing post: {str(e)}")
+                    self.record_failed(item["post"])
+                next_seq += 1
+                self.in_flight.release()
+
+    async def store(self, item):
+        post = item["post"]
+        post_id = post.get("id", "N/A")
+        result = item["result"]
+        print_post_header("Processed post", item["position"], self.total_posts, post)
+        self.stats["processed"] += 1
+        if isinstance(result, Exception):
+            print(f"Error processing post: {str(result)}")
+            self.near_duplicates.remove(post_id)
+            self.record_failed(post)
+            return
+
+        print(f"Classification: {result.category} (Confidence: {result.confidence:.2f})")
+        print(f"Reasoning: {result.reasoning}")
+
+        # Skip if post is classified as spam
+        if result.category == 'spam':
+            print("Skipping spam post...")
+            decision = analysis_to_dict(result, [])
+            self.near_duplicates.set_decision(post_id, decision)
+            if item["cacheable"]:
+                self.llm_cache.put(post["text"], decision)
+            self.stats["spam"] += 1
+            return
+
+        phone_result = item["phone_result"]
+        if isinstance(phone_result, Exception):
+            print(f"Error processing post: {str(phone_result)}")
+            self.near_duplicates.remove(post_id)
+            self.record_failed(post)
+            return
+
+        decision = analysis_to_dict(result, phone_result.phone_numbers)
+        if item["cacheable"]:
+            self.llm_cache.put(post["text"], decision)
+
+        # Format and deduplicate phone numbers
+        formatted_numbers = list(dict.fromkeys(format_phone_number(num) for num in phone_result.phone_numbers))
+        wa_no = formatted_numbers[0] if formatted_numbers else None
+
+        if wa_no:
+            print(f"Found WhatsApp number: {wa_no}")
+        else:
+            print("No WhatsApp number found")
+
+        # Add post to Google Sheets
+        user = post.get("user") or {}
+        success = await asyncio.to_thread(
+            self.sheets_handler.add_post,
+            user.get("id", "N/A"),
+            user.get("name", "Unknown"),
+            post_id,
+            post["text"],
+            post_url=post.get("url", ""),
+            wa_no=wa_no
+        )
+
+        if success:
+            # The decision is only kept once the buffered row has been written
+            self.unflushed[str(post_id)] = decision
+            self.record_flushed()
+            self.stats["job"] += 1
+            print(f"Job post stored successfully!")
+        else:
+            self.near_duplicates.remove(post_id)
+            self.record_failed(post)
+            print("Failed to store post in Google Sheets")
+
+    def record_failed(self, post):
+        self.stats["failed"] += 1
+        self.failed_posts.append(post)
+
+    def record_flushed(self):
+        """Record the decisions of posts whose rows have been written to the sheet"""
+        pending = self.sheets_handler.pending_post_ids()
+        for post_id in [post_id for post_id in self.unflushed if post_id not in pending]:
+            self.near_duplicates.set_decision(post_id, self.unflushed.pop(post_id))
+
+    async def monitor(self):
+        """Sample queue depths and print progress periodically"""
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(QUEUE_SAMPLE_SECS)
+            for name, queue in self.queues.items():
+                depth = self.queue_depths[name]
+                depth["max"] = max(depth["max"], queue.qsize())
+                depth["total"] += queue.qsize()
+                depth["samples"] += 1
+            elapsed += QUEUE_SAMPLE_SECS
+            if elapsed >= PROGRESS_INTERVAL_SECS:
+                elapsed = 0.0
+                self.print_progress()
+
+    def print_progress(self):
+        processed = self.stats["processed"]
+        total_time = time.time() - self.start_time
+        print(f"\nProgress: {processed}/{self.total_posts} posts ({(processed / self.total_posts) * 100:.1f}%)")
+        print(f"Job posts found: {self.stats['job']}")
+        print("Queue depths: " + ", ".join(
+            f"{name} {queue.qsize()}/{self.queue_size}" for name, queue in self.queues.items()
+        ))
+        if processed:
+            avg_time = total_time / processed
+            print(f"Average time per post: {avg_time:.2f} seconds")
+            print(f"Estimated time remaining: {(avg_time * (self.total_posts - processed)) / 60:.1f} minutes")
+        print("-" * 50)
+
+def process_posts(reprocess_all: bool = False, resync_state: bool = False,
+                  concurrency: int = LLM_CONCURRENCY, extract_concurrency: int = EXTRACT_CONCURRENCY,
+                  queue_size: int = PIPELINE_QUEUE_SIZE, combined: bool = COMBINED_ANALYSIS):
     # Check Groq API key
     if not os.getenv("GROQ_API_KEY"):
         print("Error: GROQ_API_KEY not found in environment variables")
         return
 
     # Initialize LangChain
-    classification_chain, phone_chain = setup_langchain()
+    chains = setup_langchain()
+    
+    # Open the content-hash cache of LLM results
+    llm_cache = LLMCache(version=f"{os.getenv('GROQ_MODEL', 'mixtral-8x7b-32768')}:{PROMPT_VERSION}")
+    
+    # Open the near-duplicate index of already decided posts
+    near_duplicates = NearDuplicateIndex()
+    near_duplicates.remove_pending()
+    
+    # Load the local spam pre-classifier, if one has been trained
+    preclassifier = load_preclassifier()
+    if preclassifier:
+        print("Using local spam pre-classifier for obvious posts")
     
     # Initialize Google Sheets handler
     sheets_handler = SheetsHandler()
-    
-    # Load Facebook data
-    print("Loading Facebook data...")
-    with open("facebook_scraped_data.json", "r", encoding="utf-8") as file:
-        data = json.load(file)
+    if resync_state:
+        print("Resyncing local state store from Google Sheets...")
+        sheets_handler.sync_state_store()
     
     # Get already processed posts
     processed_posts = get_processed_posts(sheets_handler)
     print(f"Found {len(processed_posts)} already processed posts")
     
-    # Filter out already processed posts
-    if not reprocess_all:
-        data = [post for post in data if post.get("id", "") not in processed_posts]
+    # Filter out already processed posts while streaming the Facebook data
+    def load_posts():
+        for post in iter_scraped_posts():
+            post_id = post.get("id", "")
+            if reprocess_all or (post_id not in processed_posts and post_id not in near_duplicates):
+                yield post
     
-    total_posts = len(data)
+    # Count in a first streaming pass so memory stays flat
+    print("Loading Facebook data...")
+    total_posts = sum(1 for _ in load_posts())
     if total_posts == 0:
         print("No new posts to process!")
-        return
+        save_unprocessed_posts([])
+        commit_watermarks()
+        return True
         
-    print(f"\nStarting to process {total_posts} posts...")
+    print(f"\nStarting to process {total_posts} posts (classification concurrency {concurrency}, "
+          f"extraction concurrency {extract_concurrency}, queue size {queue_size})...")
     print("=" * 50)
     
-    start_time = time.time()
-    processed_count = 0
-    job_posts_count = 0
-    spam_posts_count = 0
-    skipped_count = 0
+    pipeline = PostPipeline(
+        load_posts(), total_posts, chains, combined, llm_cache, near_duplicates, preclassifier,
+        sheets_handler, classify_concurrency=concurrency,
+        extract_concurrency=extract_concurrency, queue_size=queue_size
+    )
+    asyncio.run(pipeline.run())
+    stats = pipeline.stats
     
-    for post in data:
-        post_start_time = time.time()
-        text = post.get("text", "").strip()
-        user = post.get("user", {})
-        fb_id = user.get("id", "N/A")
-        username = user.get("name", "Unknown")
-        post_id = post.get("id", "N/A")
-        post_url = post.get("url", "")
-        
-        # Input validation
-        if not text:
-            print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Skipping post {processed_count + 1}/{total_posts}")
-            print(f"User: {username} (ID: {fb_id})")
-            print(f"Post ID: {post_id}")
-            print("Error: Post text is empty or None")
-            skipped_count += 1
-            processed_count += 1
-            continue
-            
-        if post_id in processed_posts:
-            print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Skipping already processed post {processed_count + 1}/{total_posts}")
-            print(f"User: {username} (ID: {fb_id})")
-            print(f"Post ID: {post_id}")
-            print("Post already exists in database, skipping...")
-            skipped_count += 1
-            processed_count += 1
-            continue
-        
-        print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Processing post {processed_count + 1}/{total_posts}")
-        print(f"User: {username} (ID: {fb_id})")
-        print(f"Post ID: {post_id}")
-        
-        try:
-            # Classify post using LangChain
-            print("Classifying post...")
-            result = classification_chain.invoke({"text": text})
-            classification = result.category
-            confidence = result.confidence
-            reasoning = result.reasoning
-            
-            print(f"Classification: {classification} (Confidence: {confidence:.2f})")
-            print(f"Reasoning: {reasoning}")
-            
-            # Skip if post is classified as spam
-            if classification == 'spam':
-                print("Skipping spam post...")
-                spam_posts_count += 1
-                processed_count += 1
-                continue
-            
-            # Extract phone numbers using LangChain
-            print("Extracting phone numbers...")
-            phone_result = phone_chain.invoke({"text": text})
-            phone_numbers = phone_result.phone_numbers
-            
-            # Format phone numbers
-            formatted_numbers = [format_phone_number(num) for num in phone_numbers]
-            wa_no = formatted_numbers[0] if formatted_numbers else None
-            
-            if wa_no:
-                print(f"Found WhatsApp number: {wa_no}")
-            else:
-                print("No WhatsApp number found")
-            
-            # Add post to Google Sheets
-            success = sheets_handler.add_post(
-                fb_id, 
-                username, 
-                post_id, 
-                text, 
-                post_url=post_url,
-                wa_no=wa_no
-            )
-            
-            if success:
-                job_posts_count += 1
-                processed_count += 1
-                post_time = time.time() - post_start_time
-                total_time = time.time() - start_time
-                avg_time = total_time / processed_count
-                
-                print(f"Job post stored successfully!")
-                print(f"Post processed in {post_time:.2f} seconds")
-                print(f"Progress: {processed_count}/{total_posts} posts ({(processed_count/total_posts)*100:.1f}%)")
-                print(f"Job posts found: {job_posts_count}")
-                print(f"Average time per post: {avg_time:.2f} seconds")
-                print(f"Estimated time remaining: {(avg_time * (total_posts - processed_count))/60:.1f} minutes")
-                print("-" * 50)
-            else:
-                print("Failed to store post in Google Sheets")
-            
-            # Add a small delay between posts
-            time.sleep(1)
-            
-        except Exception as e:
-            print(f"Error processing post: {str(e)}")
-            continue
+    # Write the rows still waiting in the Sheets buffer
+    flushed = sheets_handler.flush()
+    if flushed:
+        pipeline.record_flushed()
     
-    total_time = time.time() - start_time
+    total_time = time.time() - pipeline.start_time
     print(f"\nProcessing completed!")
     print(f"Total time: {total_time/60:.1f} minutes")
-    print(f"Total posts processed: {processed_count}")
-    print(f"Posts skipped (already in database): {skipped_count}")
-    print(f"Job posts found and stored: {job_posts_count}")
-    print(f"Spam posts skipped: {spam_posts_count}")
+    print(f"Total posts processed: {stats['processed']}")
+    print(f"Posts skipped (already in database): {stats['skipped']}")
+    print(f"Job posts found and stored: {stats['job']}")
+    print(f"Spam posts skipped: {stats['spam']}")
+    print(f"Posts failed: {stats['failed']}")
+    print(f"Near-duplicate posts skipped: {stats['duplicate']}")
+    print(f"Posts decided locally (LLM calls avoided): {stats['local_decisions']}")
+    print(f"Job posts with phone numbers resolved without the LLM: {stats['local_phone']}")
+    print(f"LLM cache hits: {llm_cache.hits}, misses: {llm_cache.misses}")
+    for name, depth in pipeline.queue_depths.items():
+        average = depth["total"] / depth["samples"] if depth["samples"] else 0.0
+        print(f"Queue depth ({name}): max {depth['max']}/{queue_size}, average {average:.1f}")
+
+    if not flushed:
+        # Leave the scraped file and watermarks alone so these posts are processed again
+        print(f"Error: {sheets_handler.discard_pending()} posts could not be written to Google Sheets "
+              f"and will be processed again on the next run")
+        return False
 
+    # Only the failed posts stay in the scraped file, so they are retried even
+    # though their groups' watermarks move on
+    if pipeline.failed_posts:
+        print(f"Keeping {len(pipeline.failed_posts)} failed posts in {SCRAPED_DATA_FILE} to retry on the next run")
+    save_unprocessed_posts(pipeline.failed_posts)
+    commit_watermarks()
     return True
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process Facebook posts using LangChain and Groq')
     parser.add_argument('--reprocess-all', action='store_true', help='Reprocess all posts, including already processed ones')
+    parser.add_argument('--resync-state', action='store_true', help='Rebuild the local state store from Google Sheets before processing')
+    parser.add_argument('--concurrency', type=int, default=LLM_CONCURRENCY, help='Maximum concurrent LLM classification calls')
+    parser.add_argument('--extract-concurrency', type=int, default=EXTRACT_CONCURRENCY, help='Maximum concurrent phone number extractions')
+    parser.add_argument('--queue-size', type=int, default=PIPELINE_QUEUE_SIZE, help='Maximum posts waiting between two pipeline stages')
+    parser.add_argument('--two-call', action='store_true', help='Classify and extract phone numbers with separate LLM calls')
     args = parser.parse_args()
     
-    process_posts(reprocess_all=args.reprocess_all) 
\ No newline at end of file
+    process_posts(
+        reprocess_all=args.reprocess_all,
+        resync_state=args.resync_state,
+        concurrency=args.concurrency,
+        extract_concurrency=args.extract_concurrency,
+        queue_size=args.queue_size,
+        combined=COMBINED_ANALYSIS and not args.two_call
+    )
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Starting budgets; the Groq rate-limit headers take over after the first response
+REQUESTS_PER_MINUTE = float(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+TOKENS_PER_MINUTE = float(os.getenv("GROQ_TOKENS_PER_MINUTE", "6000"))
+# Completion tokens assumed per request when estimating its cost up front
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("GROQ_EXPECTED_COMPLETION_TOKENS", "300"))
+MAX_BACKOFF_SECS = float(os.getenv("GROQ_MAX_BACKOFF_SECS", "60"))
+# Windows the x-ratelimit-limit-* headers are counted over: Groq reports
+# requests per day and tokens per minute
+LIMIT_WINDOW_SECS = {
+    "requests": float(os.getenv("GROQ_REQUEST_LIMIT_WINDOW_SECS", str(24 * 60 * 60))),
+    "tokens": float(os.getenv("GROQ_TOKEN_LIMIT_WINDOW_SECS", "60"))
+}
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse Groq reset durations such as '2m59.56s', '7.66s' or '120ms' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    matches = DURATION_PATTERN.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in matches)
+
+def parse_number(value: Optional[str]) -> Optional[float]:
+    """Parse a numeric rate-limit header"""
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class TokenBucket:
+    """Token bucket that refills continuously up to its capacity"""
+
+    def __init__(self, capacity: float, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_sec)
+        self.updated = now
+
+    def resize(self, capacity: float, refill_per_sec: float) -> None:
+        """Change the budget, keeping the current level within the new capacity"""
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = min(self.tokens, capacity)
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_sec
+
+class GroqRateLimiter:
+    """Process-wide limiter for Groq requests and tokens
+
+    Every request waits for both buckets before it is sent. Responses size the
+    buckets from the x-ratelimit-limit-* headers and set their level from the
+    x-ratelimit-remaining-* headers, so the budget follows the account's real
+    limits up as well as down. A 429 pauses all callers until retry-after (or
+    an exponential backoff) has passed.
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.paused_until = 0.0
+        self.backoff = 1.0
+        self.lock = threading.Lock()
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Take a request slot if one is free, otherwise return how long to wait"""
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1),
+                self.tokens.wait_time(estimated_tokens)
+            )
+            if wait <= 0:
+                self.requests.tokens -= 1
+                self.tokens.tokens -= estimated_tokens
+            return wait
+
+    def acquire(self, estimated_tokens: int) -> None:
+        """Block until a request of about `estimated_tokens` may be sent"""
+        while (wait := self.reserve(estimated_tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens: int) -> None:
+        while (wait := self.reserve(estimated_tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def observe(self, status_code: int, headers) -> None:
+        """Adapt the buckets to a Groq response"""
+        with self.lock:
+            now = time.monotonic()
+            if status_code == 429:
+                retry_after = parse_duration(headers.get("retry-after"))
+                delay = retry_after if retry_after is not None else self.backoff
+                self.backoff = min(self.backoff * 2, MAX_BACKOFF_SECS)
+                self.paused_until = max(self.paused_until, now + delay)
+                return
+            self.backoff = 1.0
+
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                bucket.refill(now)
+                limit = parse_number(headers.get(f"x-ratelimit-limit-{kind}"))
+                if limit:
+                    bucket.resize(limit, limit / LIMIT_WINDOW_SECS[kind])
+                remaining = parse_number(headers.get(f"x-ratelimit-remaining-{kind}"))
+                if remaining is None:
+                    continue
+                # The server's count includes requests sent from elsewhere
+                bucket.tokens = min(remaining, bucket.capacity)
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if remaining <= 0 and reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """Roughly estimate a request's token cost from its body size"""
+    try:
+        body_size = len(request.content)
+    except httpx.RequestNotRead:
+        body_size = 0
+    return body_size // 4 + EXPECTED_COMPLETION_TOKENS
+
+_limiter = GroqRateLimiter()
+_http_client = None
+_async_http_client = None
+
+def get_limiter() -> GroqRateLimiter:
+    return _limiter
+
+def _before_request(request: httpx.Request) -> None:
+    _limiter.acquire(estimate_tokens(request))
+
+def _after_response(response: httpx.Response) -> None:
+    _limiter.observe(response.status_code, response.headers)
+
+async def _before_request_async(request: httpx.Request) -> None:
+    await _limiter.acquire_async(estimate_tokens(request))
+
+async def _after_response_async(response: httpx.Response) -> None:
+    _limiter.observe(response.status_code, response.headers)
+
+def get_groq_http_client() -> httpx.Client:
+    """Get the shared HTTP client that routes every Groq call through the limiter"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(
+            timeout=HTTP_TIMEOUT,
+            event_hooks={"request": [_before_request], "response": [_after_response]}
+        )
+    return _http_client
+
+def get_groq_async_http_client() -> httpx.AsyncClient:
+    """Get the shared async HTTP client that routes every Groq call through the limiter"""
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            event_hooks={"request": [_before_request_async], "response": [_after_response_async]}
+        )
+    return _async_http_client
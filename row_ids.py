@@ -0,0 +1,76 @@
+import threading
+from typing import List, Optional
+from gspread.utils import rowcol_to_a1
+
+def parse_id(value) -> Optional[int]:
+    """Parse an id cell, which Sheets may return as '12' or '12.0'"""
+    try:
+        return int(float(str(value).strip()))
+    except ValueError:
+        return None
+
+class RowIdAllocator:
+    """Hand out sequential row ids without downloading the sheet for every insert
+
+    The id column is read once to find the largest id, after which ids come from
+    a local counter. An append that lands on a different row than expected means
+    someone else wrote to the sheet, so the column is read again and the rows
+    just written are renumbered if their ids were taken.
+    """
+
+    def __init__(self, worksheet, id_column: int = 1):
+        self.worksheet = worksheet
+        self.id_column = id_column
+        self.next_id = None
+        self.next_row = None
+        self.lock = threading.Lock()
+
+    def _read_ids(self) -> List[Optional[int]]:
+        # One entry per data row; row 1 is the header
+        return [parse_id(value) for value in self.worksheet.col_values(self.id_column)[1:]]
+
+    def _sync(self, ids: List[Optional[int]]) -> None:
+        self.next_id = max((row_id for row_id in ids if row_id is not None), default=0) + 1
+        self.next_row = len(ids) + 2
+
+    def sync(self) -> None:
+        """Reload the largest id and the next free row from the sheet"""
+        with self.lock:
+            self._sync(self._read_ids())
+
+    def allocate(self, count: int = 1) -> int:
+        """Reserve `count` consecutive ids and return the first"""
+        with self.lock:
+            if self.next_id is None:
+                self._sync(self._read_ids())
+            first_id = self.next_id
+            self.next_id += count
+            return first_id
+
+    def confirm(self, first_row: Optional[int], first_id: int, count: int = 1) -> int:
+        """Check where appended rows landed and get the first id they ended up with"""
+        with self.lock:
+            if self.next_row is None or first_row is None or first_row == self.next_row:
+                if self.next_row is not None:
+                    self.next_row += count
+                return first_id
+
+            print(f"Rows landed at {first_row} instead of {self.next_row}, re-syncing row ids")
+            ids = self._read_ids()
+            self._sync(ids)
+            written = set(range(first_id, first_id + count))
+            taken = {
+                row_id for row, row_id in enumerate(ids, start=2)
+                if not first_row <= row < first_row + count
+            }
+            if not written & taken:
+                return first_id
+
+            # Another writer used the same ids, so renumber the rows just written
+            new_first_id = self.next_id
+            self.next_id += count
+            self.worksheet.update(
+                range_name=f"{rowcol_to_a1(first_row, self.id_column)}:{rowcol_to_a1(first_row + count - 1, self.id_column)}",
+                values=[[str(new_first_id + offset)] for offset in range(count)]
+            )
+            return new_first_id
@@ -1,9 +1,18 @@
 import subprocess
+import importlib
 import os
 import sys
 from datetime import datetime
 import logging
 
+# "inprocess" calls stage entry points directly, "subprocess" runs each stage in a fresh interpreter
+STAGE_ISOLATION = os.getenv('STAGE_ISOLATION', 'inprocess')
+
+# Stages to run in sequence as (module, entry point)
+STAGES = [
+    ("apify_data", "main")
+]
+
 def setup_logging():
     """Set up logging configuration"""
     log_dir = "logs"
@@ -24,52 +33,81 @@ def setup_logging():
     return log_file
 
 def run_script(script_name: str) -> bool:
-    """Run a Python script and return True if successful"""
+    """Run a Python script in a subprocess, streaming its output, and return True if successful"""
     try:
         # Get the full path of the script
-        script_path = os.path.join(os.path.dirname(__file__), script_name)
+        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script_name)
         
         # Check if script exists
         if not os.path.exists(script_path):
             logging.error(f"Script not found: {script_path}")
             return False
         
-        # Run the script
+        # Run the script and log its output line by line as it is produced
         logging.info(f"Running script: {script_name}")
-        result = subprocess.run(['python', script_path], capture_output=True, text=True)
-        
-        # Log output
-        if result.stdout:
-            logging.info(f"Script output:\n{result.stdout}")
-        if result.stderr:
-            logging.error(f"Script errors:\n{result.stderr}")
+        process = subprocess.Popen(
+            [sys.executable, script_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='replace'
+        )
+        for line in process.stdout:
+            logging.info(f"[{script_name}] {line.rstrip()}")
+        returncode = process.wait()
         
         # Check if script was successful
-        if result.returncode == 0:
+        if returncode == 0:
             logging.info(f"Script completed successfully: {script_name}")
             return True
         else:
-            logging.error(f"Script failed with return code {result.returncode}: {script_name}")
+            logging.error(f"Script failed with return code {returncode}: {script_name}")
             return False
             
     except Exception as e:
         logging.error(f"Error running script {script_name}: {str(e)}")
         return False
 
-def run_data_collection():
+def run_stage(module_name: str, entry_point: str = "main", isolated: bool = None) -> bool:
+    """Run a pipeline stage and return True if successful
+    
+    In-process stages are imported once and keep their module-level clients warm
+    between iterations. Set isolated (or STAGE_ISOLATION=subprocess) to run the
+    stage in a fresh interpreter instead.
+    """
+    if isolated is None:
+        isolated = STAGE_ISOLATION == 'subprocess'
+    if isolated:
+        return run_script(f"{module_name}.py")
+    
+    try:
+        logging.info(f"Running stage: {module_name}.{entry_point}")
+        module = importlib.import_module(module_name)
+        result = getattr(module, entry_point)()
+        if result is False:
+            logging.error(f"Stage failed: {module_name}")
+            return False
+        logging.info(f"Stage completed successfully: {module_name}")
+        return True
+    except SystemExit as e:
+        if e.code in (None, 0):
+            return True
+        logging.error(f"Stage exited with code {e.code}: {module_name}")
+        return False
+    except Exception as e:
+        logging.error(f"Error running stage {module_name}: {str(e)}")
+        return False
+
+def run_data_collection(isolated: bool = None):
     # Set up logging
     log_filename = setup_logging()
     logging.info("Starting data collection process...")
     
-    # List of scripts to run in sequence
-    scripts = [
-        "apify_data.py"
-    ]
-    
-    # Run each script
-    for script in scripts:
-        if not run_script(script):
-            logging.error(f"Data collection failed at {script}")
+    # Run each stage
+    for module_name, entry_point in STAGES:
+        if not run_stage(module_name, entry_point, isolated=isolated):
+            logging.error(f"Data collection failed at {module_name}")
             return False
     
     logging.info("Data collection completed successfully!")
@@ -1,80 +1,31 @@
-import json
 import os
 from datetime import datetime, timedelta
-import re
 import time
 import random
 from typing import List, Dict, Optional
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 import importlib.util
 from sheets_handler import SheetsHandler
 from followup_handler import FollowupHandler
+from llm_clients import get_llm
+from phone_numbers import extract_phone_numbers, format_phone_number
+from message_history import get_message_history_store
 import whatsapp
 
 # Load environment variables
 load_dotenv()
 
-def format_phone_number(phone: str) -> str:
-    # Remove spaces and keep existing + if present
-    if phone.startswith('+'):
-        return '+' + re.sub(r'\s+', '', phone[1:])
-    return '+' + re.sub(r'\s+', '', phone)
-
-def extract_phone_numbers(text: str) -> List[str]:
-    patterns = [
-        r'\b\d{10}\b',
-        r'\b\d{11}\b',
-        r'\+\d{10,12}\b',
-        r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',
-        r'\b\d{4}[-.]?\d{3}[-.]?\d{3}\b'
-    ]
-    
-    phone_numbers = []
-    for pattern in patterns:
-        matches = re.finditer(pattern, text)
-        for match in matches:
-            phone_numbers.append(format_phone_number(match.group()))
-    
-    return phone_numbers
-
 def get_message_history(user_id: str) -> List[Dict]:
-    history_file = f"db/history/{user_id}.json"
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+    """Get the last few messages sent to a user, which is all the prompt uses"""
+    return get_message_history_store().last_n(user_id, 3)
 
 def save_message_history(user_id: str, message: str, platform: str):
-    # Create history directory if it doesn't exist
-    os.makedirs("db/history", exist_ok=True)
-    
-    history_file = f"db/history/{user_id}.json"
-    history = get_message_history(user_id)
-    
-    # Add new message to history
-    history.append({
-        "timestamp": datetime.now().isoformat(),
-        "message": message,
-        "platform": platform
-    })
-    
-    # Save updated history
-    with open(history_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f, indent=4)
+    get_message_history_store().append(user_id, message, platform)
 
-def generate_message(post_text: str, message_history: List[Dict]) -> str:
-    # Initialize Groq model
-    llm = ChatGroq(
-        model_name=os.getenv("GROQ_MODEL", "mixtral-8x7b-32768"),
-        temperature=float(os.getenv("TEMPERATURE", "0.7")),
-        api_key=os.getenv("GROQ_API_KEY")
-    )
-    
-    # Create prompt template
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """Your task is to compose a personalized message based on the template for out reach for a company Ta'al!. Your name is Subash
+# Outreach message prompt, built once at import
+MESSAGE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Your task is to compose a personalized message based on the template for out reach for a company Ta'al!. Your name is Subash
         
         Job post text:
         {post_text}
@@ -100,7 +51,10 @@ def generate_message(post_text: str, message_history: List[Dict]) -> str:
         Looking forward to hearing from you.        
         
         """),
-    ])
+])
+
+def generate_message(post_text: str, message_history: List[Dict]) -> str:
+    llm = get_llm(float(os.getenv("TEMPERATURE", "0.7")))
     
     # Format message history for the prompt
     formatted_history = "\n".join([
@@ -109,7 +63,7 @@ def generate_message(post_text: str, message_history: List[Dict]) -> str:
     ]) if message_history else "No previous messages"
     
     # Generate message
-    response = llm.invoke(prompt.format(
+    response = llm.invoke(MESSAGE_PROMPT.format(
         message_history=formatted_history,
         post_text=post_text
     ))
@@ -140,8 +94,7 @@ def process_unanswered_posts():
     messaged_users = set()
     
     for post in unanswered_posts:
-        time.sleep(random.uniform(4, 8))
-        post_id = post['id']
+        post_id = post['post_id']
         user_id = post['user_id']
         username = post['username']
         post_text = post['post_text']
@@ -162,8 +115,11 @@ def process_unanswered_posts():
             message = generate_message(post_text, message_history)
             print(f"Generated message: {message}")
             
-            # Extract phone number from post text
+            # Extract phone number from post text, falling back to the number
+            # stored when the post was processed (possibly resolved by the LLM)
             phone_numbers = extract_phone_numbers(post_text)
+            if not phone_numbers and str(post.get('wa_no', '')).strip():
+                phone_numbers = [format_phone_number(post['wa_no'])]
             
             message_sent = False
             platform_used = None
@@ -174,6 +130,8 @@ def process_unanswered_posts():
                 if not formatted_phone.startswith('+'):
                     formatted_phone = '+' + formatted_phone
                 
+                # Pace WhatsApp sends like a person would; LLM calls are paced by the shared rate limiter
+                time.sleep(random.uniform(4, 8))
                 print(f"Attempting to send WhatsApp message to {formatted_phone}")
                 if send_whatsapp_message(formatted_phone, message):
                     # Update WhatsApp number in Google Sheets only if message sent
@@ -221,6 +179,14 @@ def process_unanswered_posts():
             print(f"Error processing post {post_id}: {str(e)}")
             continue
     
+    # Write the follow-up messages composed in the background during the cycle
+    followup_handler.finish_drafts()
+    
+    # Write this cycle's status and WhatsApp number changes in one request;
+    # anything left unwritten stays queued and is retried before the next cycle
+    if not sheets_handler.flush_updates():
+        print("Failed to write message status updates to Google Sheets")
+    
     print("\nFinished processing all unanswered posts")
     print(f"Messaged {len(messaged_users)} unique users in this execution")
 
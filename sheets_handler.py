@@ -1,17 +1,43 @@
 from google.oauth2.service_account import Credentials
 import gspread
+import atexit
+import threading
+import time
+import weakref
 from datetime import datetime
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 import os
+from state_store import StateStore, row_from_append_response
+from row_ids import RowIdAllocator
+from gspread.utils import rowcol_to_a1
 
 # Load environment variables
 load_dotenv()
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# New posts are buffered and appended together once this many are waiting
+# or the oldest has waited this long
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "20"))
+SHEETS_BATCH_MAX_AGE_SECS = float(os.getenv("SHEETS_BATCH_MAX_AGE_SECS", "30"))
+POST_ID_COLUMN = 4
+MESSAGE_SENT_COLUMN = 7
+WA_NO_COLUMN = 8
+
+# Live handlers, flushed once at exit; a weak set so finished handlers can be freed
+_handlers = weakref.WeakSet()
+
+def flush_all():
+    """Write the rows and cell changes every live handler still has buffered"""
+    for handler in list(_handlers):
+        handler.flush()
+        handler.flush_updates()
+
+atexit.register(flush_all)
 
 class SheetsHandler:
-    def __init__(self, credentials_file="credentials.json"):
+    def __init__(self, credentials_file="credentials.json", batch_size=SHEETS_BATCH_SIZE,
+                 batch_max_age=SHEETS_BATCH_MAX_AGE_SECS):
         self.credentials = Credentials.from_service_account_file(credentials_file, scopes=SCOPES)
         self.client = gspread.authorize(self.credentials)
         self.social_media_sheet = self.client.open_by_key(os.getenv("SOCIAL_MEDIA_SHEET_ID"))
@@ -24,40 +50,195 @@ class SheetsHandler:
                 'id', 'user_id', 'username', 'post_id', 'post_text', 
                 'post_url', 'message_sent', 'wa_no'
             ])
+        
+        # Local index of processed posts, loaded from the sheet once
+        self.state_store = StateStore()
+        if not self.state_store.is_synced():
+            self.sync_state_store()
+        
+        # Row ids are allocated locally instead of scanning the sheet per insert
+        self.row_ids = RowIdAllocator(self.worksheet)
+        
+        # Write-behind buffer of new rows, flushed with one append_rows call
+        self.batch_size = batch_size
+        self.batch_max_age = batch_max_age
+        self.pending_rows = []
+        self.pending_since = None
+        self.buffer_lock = threading.RLock()
+        
+        # post_id -> row map read from the post_id column on first use; cell
+        # changes wait in the state store for one batch_update
+        self.row_index = None
+        _handlers.add(self)
+    
+    def sync_state_store(self):
+        """Rebuild the local state store from the sheet"""
+        try:
+            self.state_store.rebuild(self.worksheet.get_all_records())
+            return True
+        except Exception as e:
+            print(f"Error syncing state store from Google Sheet: {str(e)}")
+            return False
+    
+    def has_post(self, post_id):
+        """Check whether a post is already in the sheet or waiting to be written"""
+        with self.buffer_lock:
+            if any(pending['post_id'] == str(post_id) for pending in self.pending_rows):
+                return True
+        return post_id in self.state_store
+    
+    def pending_count(self):
+        """Get the number of posts waiting in the write buffer"""
+        with self.buffer_lock:
+            return len(self.pending_rows)
+    
+    def pending_post_ids(self):
+        """Get the ids of the posts waiting in the write buffer"""
+        with self.buffer_lock:
+            return {pending['post_id'] for pending in self.pending_rows}
+    
+    def discard_pending(self):
+        """Drop the buffered posts, e.g. when they will be processed again, and return how many there were"""
+        with self.buffer_lock:
+            count = len(self.pending_rows)
+            self.pending_rows = []
+            self.pending_since = None
+            return count
+    
+    def flush(self):
+        """Append all buffered posts in one call; on failure they stay buffered for the next flush"""
+        with self.buffer_lock:
+            if not self.pending_rows:
+                return True
+            try:
+                count = len(self.pending_rows)
+                # Ids are allocated once per row and kept when a write fails, so
+                # retries don't leave gaps in the id column
+                first_id = self.assign_row_ids()
+                rows = [[str(first_id + offset)] + pending['row'] for offset, pending in enumerate(self.pending_rows)]
+                response = self.worksheet.append_rows(rows)
+                first_row = row_from_append_response(response)
+                first_id = self.row_ids.confirm(first_row, first_id, count)
+                for offset, pending in enumerate(self.pending_rows):
+                    if self.row_index is not None and first_row:
+                        self.row_index[pending['post_id']] = first_row + offset
+                    self.state_store.add_post(
+                        pending['post_id'],
+                        id=first_id + offset,
+                        row_number=first_row + offset if first_row else None,
+                        wa_no=pending['wa_no']
+                    )
+                self.pending_rows = []
+                self.pending_since = None
+                return True
+            except Exception as e:
+                print(f"Error writing {len(self.pending_rows)} buffered posts to Google Sheet: {str(e)}")
+                return False
+    
+    def assign_row_ids(self):
+        """Give buffered rows without an id the next ids and return the first row's id"""
+        fresh = [pending for pending in self.pending_rows if 'id' not in pending]
+        if fresh:
+            next_id = self.row_ids.allocate(len(fresh))
+            for offset, pending in enumerate(fresh):
+                pending['id'] = next_id + offset
+        first_id = self.pending_rows[0]['id']
+        if any(pending['id'] != first_id + offset for offset, pending in enumerate(self.pending_rows)):
+            # Rows are written with consecutive ids
+            first_id = self.row_ids.allocate(len(self.pending_rows))
+            for offset, pending in enumerate(self.pending_rows):
+                pending['id'] = first_id + offset
+        return first_id
     
     def get_unanswered_posts(self):
         """Get all posts where message_sent is 0"""
         try:
+            # Changes left over from a cycle whose write failed are written first,
+            # and posts still queued as sent are skipped so nobody is messaged twice
+            self.flush_updates()
+            sent_posts = {
+                post_id for (post_id, column), value in self.state_store.pending_updates().items()
+                if column == MESSAGE_SENT_COLUMN and value == '1'
+            }
             all_records = self.worksheet.get_all_records()
-            return [record for record in all_records if str(record['message_sent']) in ['0', '0.0', '0.00']]
+            return [
+                record for record in all_records
+                if str(record['message_sent']) in ['0', '0.0', '0.00'] and str(record['post_id']) not in sent_posts
+            ]
         except Exception as e:
             print(f"Error reading Google Sheet: {str(e)}")
             return []
     
+    def load_row_index(self):
+        """Map every post_id to its sheet row with one read of the post_id column"""
+        column = self.worksheet.col_values(POST_ID_COLUMN)
+        self.row_index = {
+            str(post_id): row for row, post_id in enumerate(column[1:], start=2) if str(post_id).strip()
+        }
+    
+    def get_row(self, post_id):
+        """Get the sheet row of a post, re-reading the column once for posts added elsewhere"""
+        post_id = str(post_id)
+        if self.row_index is None or post_id not in self.row_index:
+            self.load_row_index()
+        return self.row_index.get(post_id)
+    
+    def queue_update(self, post_id, column, value):
+        """Queue a cell change of a post for the next flush_updates call"""
+        if self.get_row(post_id) is None:
+            return False
+        with self.buffer_lock:
+            self.state_store.queue_update(post_id, column, value)
+        return True
+    
+    def flush_updates(self):
+        """Write all queued cell changes in one batch_update; on failure they stay queued in the state store
+
+        Changes are queued by post, and the post rows are read again here so a
+        change never lands on another post after rows were deleted or sorted.
+        """
+        with self.buffer_lock:
+            pending_updates = self.state_store.pending_updates()
+            if not pending_updates:
+                return True
+            try:
+                self.load_row_index()
+                updates = {
+                    (post_id, column): value for (post_id, column), value in pending_updates.items()
+                    if post_id in self.row_index
+                }
+                missing = {key: value for key, value in pending_updates.items() if key not in updates}
+                if missing:
+                    print(f"Dropping {len(missing)} queued updates for posts no longer in the Google Sheet")
+                if updates:
+                    self.worksheet.batch_update([
+                        {'range': rowcol_to_a1(self.row_index[post_id], column), 'values': [[value]]}
+                        for (post_id, column), value in updates.items()
+                    ], raw=False)
+                for (post_id, column), value in updates.items():
+                    if column == MESSAGE_SENT_COLUMN:
+                        self.state_store.update_post(post_id, message_sent=value == '1')
+                    elif column == WA_NO_COLUMN:
+                        self.state_store.update_post(post_id, wa_no=value)
+                self.state_store.clear_updates(pending_updates)
+                return True
+            except Exception as e:
+                print(f"Error writing {len(pending_updates)} queued updates to Google Sheet: {str(e)}")
+                return False
+    
     def mark_message_sent(self, post_id):
-        """Mark a post as message sent"""
+        """Queue marking a post as message sent"""
         try:
-            # Find the row with the matching post_id
-            cell = self.worksheet.find(str(post_id))
-            if cell:
-                # Update message_sent to 1 (column G)
-                self.worksheet.update_cell(cell.row, 7, '1')
-                return True
-            return False
+            return self.queue_update(post_id, MESSAGE_SENT_COLUMN, '1')
         except Exception as e:
             print(f"Error updating Google Sheet: {str(e)}")
             return False
     
     def add_post(self, user_id, username, post_id, post_text, post_url=None, wa_no=None):
-        """Add a new post to the Google Sheet"""
+        """Queue a new post for the Google Sheet, flushing the buffer when it is full or old"""
         try:
-            # Get all records to determine new ID
-            all_records = self.worksheet.get_all_records()
-            new_id = 1 if not all_records else max(int(record['id']) for record in all_records) + 1
-            
-            # Prepare new row
+            # Prepare new row; its id is allocated when the buffer is written
             new_row = [
-                str(new_id),
                 str(user_id),
                 str(username),
                 str(post_id),
@@ -67,22 +248,27 @@ class SheetsHandler:
                 str(wa_no) if wa_no else ''
             ]
             
-            # Append new row
-            self.worksheet.append_row(new_row)
+            # Buffer the row; it is mirrored in the local state store once written
+            with self.buffer_lock:
+                self.pending_rows.append({
+                    'row': new_row,
+                    'post_id': str(post_id),
+                    'wa_no': wa_no
+                })
+                if self.pending_since is None:
+                    self.pending_since = time.time()
+                if (len(self.pending_rows) >= self.batch_size
+                        or time.time() - self.pending_since >= self.batch_max_age):
+                    self.flush()
             return True
         except Exception as e:
             print(f"Error adding post to Google Sheet: {str(e)}")
             return False
     
     def update_whatsapp_number(self, post_id, wa_no):
-        """Update WhatsApp number for a post"""
+        """Queue an update of the WhatsApp number for a post"""
         try:
-            cell = self.worksheet.find(str(post_id))
-            if cell:
-                # Update wa_no (column H)
-                self.worksheet.update_cell(cell.row, 8, str(wa_no))
-                return True
-            return False
+            return self.queue_update(post_id, WA_NO_COLUMN, str(wa_no))
         except Exception as e:
             print(f"Error updating WhatsApp number: {str(e)}")
             return False
@@ -0,0 +1,226 @@
+import json
+import os
+import re
+import sys
+import time
+import zlib
+import random
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+MODEL_FILE = "db/spam_model.npz"
+DECISIONS_FILE = "db/llm_decisions.ndjson"
+N_FEATURES = 2 ** 18
+
+# Posts with P(job) at or below SPAM_BELOW are spam, at or above JOB_ABOVE are jobs;
+# everything in between is left to the LLM
+SPAM_BELOW = float(os.getenv("PRECLASSIFIER_SPAM_BELOW", "0.05"))
+JOB_ABOVE = float(os.getenv("PRECLASSIFIER_JOB_ABOVE", "0.95"))
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+URL_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
+PHONE_PATTERN = re.compile(r"\+?\d[\d\s\-]{7,}\d")
+
+def tokenize(text: str) -> List[str]:
+    """Split a post into word unigrams, bigrams and a few structural tokens"""
+    words = TOKEN_PATTERN.findall(text.lower())
+    tokens = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if URL_PATTERN.search(text):
+        tokens.append("__url__")
+    if PHONE_PATTERN.search(text):
+        tokens.append("__phone__")
+    tokens.append(f"__len_{min(len(words) // 20, 10)}__")
+    return tokens
+
+def hashed_features(text: str, n_features: int = N_FEATURES) -> Tuple[np.ndarray, np.ndarray]:
+    """Turn a post into L2-normalized hashed feature indices and values"""
+    counts: Dict[int, float] = {}
+    for token in tokenize(text):
+        index = zlib.crc32(token.encode("utf-8")) % n_features
+        counts[index] = counts.get(index, 0.0) + 1.0
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.log1p(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+    norm = np.linalg.norm(values)
+    if norm > 0:
+        values /= norm
+    return indices, values
+
+class SpamClassifier:
+    """Logistic regression over hashed text features predicting P(job)"""
+
+    def __init__(self, n_features: int = N_FEATURES):
+        self.n_features = n_features
+        self.weights = np.zeros(n_features)
+        self.bias = 0.0
+
+    def predict_proba(self, text: str) -> float:
+        """Get the probability that a post is a job post"""
+        indices, values = hashed_features(text, self.n_features)
+        score = float(self.weights[indices] @ values) + self.bias
+        return float(1.0 / (1.0 + np.exp(-score)))
+
+    def fit(self, texts: List[str], labels: List[int], epochs: int = 10,
+            learning_rate: float = 0.5, l2: float = 1e-6, seed: int = 0) -> None:
+        """Train with stochastic gradient descent; labels are 1 for job and 0 for spam"""
+        samples = [hashed_features(text, self.n_features) for text in texts]
+        order = list(range(len(samples)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch)
+            for i in order:
+                indices, values = samples[i]
+                score = float(self.weights[indices] @ values) + self.bias
+                error = labels[i] - 1.0 / (1.0 + np.exp(-score))
+                self.weights[indices] += rate * (error * values - l2 * self.weights[indices])
+                self.bias += rate * error
+
+    def save(self, path: str = MODEL_FILE) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, weights=self.weights, bias=np.array([self.bias]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = MODEL_FILE) -> "SpamClassifier":
+        data = np.load(path)
+        model = cls(n_features=len(data["weights"]))
+        model.weights = data["weights"]
+        model.bias = float(data["bias"][0])
+        return model
+
+class PreClassifier:
+    """Decide obvious posts locally and pass only the uncertain middle band to the LLM"""
+
+    def __init__(self, model: SpamClassifier, spam_below: float = SPAM_BELOW, job_above: float = JOB_ABOVE):
+        self.model = model
+        self.spam_below = spam_below
+        self.job_above = job_above
+
+    def classify(self, text: str) -> Optional[Tuple[str, float]]:
+        """Get (category, confidence) for a confident prediction, or None if the LLM should decide"""
+        p_job = self.model.predict_proba(text)
+        if p_job >= self.job_above:
+            return "job", p_job
+        if p_job <= self.spam_below:
+            return "spam", 1.0 - p_job
+        return None
+
+def load_preclassifier(path: str = MODEL_FILE) -> Optional[PreClassifier]:
+    """Load the pre-classifier if a trained model exists"""
+    if os.getenv("PRECLASSIFIER_ENABLED", "true").lower() != "true" or not os.path.exists(path):
+        return None
+    try:
+        return PreClassifier(SpamClassifier.load(path))
+    except Exception as e:
+        print(f"Error loading spam pre-classifier: {str(e)}")
+        return None
+
+def record_decision(post_id: str, text: str, category: str, confidence: float,
+                    path: str = DECISIONS_FILE) -> None:
+    """Append an LLM classification to the training log"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "post_id": str(post_id),
+            "text": text,
+            "category": category,
+            "confidence": confidence,
+            "timestamp": datetime.now().isoformat()
+        }, ensure_ascii=False))
+        f.write("\n")
+
+def load_training_data(path: str = DECISIONS_FILE, include_sheet: bool = True) -> Tuple[List[str], List[int]]:
+    """Load labelled posts from past LLM decisions and the processed-post history"""
+    examples: Dict[str, int] = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                decision = json.loads(line)
+                if decision.get("text") and decision.get("category") in ("job", "spam"):
+                    examples[decision["text"]] = 1 if decision["category"] == "job" else 0
+    if include_sheet:
+        # Every post stored in the sheet was accepted as a job post
+        from sheets_handler import SheetsHandler
+        for post in SheetsHandler().get_all_posts():
+            text = str(post.get("post_text", "")).strip()
+            if text:
+                examples.setdefault(text, 1)
+    texts = list(examples.keys())
+    return texts, [examples[text] for text in texts]
+
+def split_holdout(texts: List[str], labels: List[int], holdout: float = 0.2, seed: int = 0):
+    """Split examples into a deterministic train and test set"""
+    order = list(range(len(texts)))
+    random.Random(seed).shuffle(order)
+    cut = int(len(order) * (1 - holdout))
+    train, test = order[:cut], order[cut:]
+    return ([texts[i] for i in train], [labels[i] for i in train],
+            [texts[i] for i in test], [labels[i] for i in test])
+
+def retrain(include_sheet: bool = True) -> bool:
+    """Train the pre-classifier on all labelled posts and save it"""
+    texts, labels = load_training_data(include_sheet=include_sheet)
+    if len(set(labels)) < 2:
+        print("Need both job and spam examples to train the pre-classifier")
+        return False
+    model = SpamClassifier()
+    start_time = time.time()
+    model.fit(texts, labels)
+    model.save()
+    print(f"Trained on {len(texts)} posts ({sum(labels)} job, {len(labels) - sum(labels)} spam) "
+          f"in {time.time() - start_time:.1f} seconds")
+    print(f"Model saved to {MODEL_FILE}")
+    return True
+
+def report(include_sheet: bool = True) -> bool:
+    """Print held-out accuracy, throughput and the share of LLM calls the thresholds avoid"""
+    texts, labels = load_training_data(include_sheet=include_sheet)
+    if len(set(labels)) < 2:
+        print("Need both job and spam examples to evaluate the pre-classifier")
+        return False
+    train_texts, train_labels, test_texts, test_labels = split_holdout(texts, labels)
+    model = SpamClassifier()
+    model.fit(train_texts, train_labels)
+    preclassifier = PreClassifier(model)
+
+    start_time = time.time()
+    probabilities = [model.predict_proba(text) for text in test_texts]
+    elapsed = time.time() - start_time
+
+    correct = sum((p >= 0.5) == bool(label) for p, label in zip(probabilities, test_labels))
+    decided = [
+        (preclassifier.classify(text), label)
+        for text, label in zip(test_texts, test_labels)
+    ]
+    decided = [(result, label) for result, label in decided if result is not None]
+    decided_correct = sum((result[0] == "job") == bool(label) for result, label in decided)
+
+    print(f"Training posts: {len(train_texts)}, held-out posts: {len(test_texts)}")
+    print(f"Accuracy at 0.5: {correct / len(test_texts):.3f}")
+    print(f"Thresholds: spam <= {preclassifier.spam_below}, job >= {preclassifier.job_above}")
+    print(f"Decided locally: {len(decided)}/{len(test_texts)} "
+          f"({len(decided) / len(test_texts) * 100:.1f}% fewer LLM calls)")
+    if decided:
+        print(f"Accuracy on locally decided posts: {decided_correct / len(decided):.3f}")
+    print(f"Throughput: {len(test_texts) / elapsed if elapsed else float('inf'):.0f} posts/second")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train and evaluate the local spam pre-classifier')
+    parser.add_argument('command', choices=['retrain', 'report'], help='Retrain the model or print an offline evaluation report')
+    parser.add_argument('--no-sheet', action='store_true', help='Only use the LLM decision log, not the posts stored in Google Sheets')
+    args = parser.parse_args()
+
+    command = retrain if args.command == 'retrain' else report
+    if not command(include_sheet=not args.no_sheet):
+        sys.exit(1)
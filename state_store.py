@@ -0,0 +1,159 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+STATE_DB_FILE = "db/state.db"
+
+def row_from_append_response(response: Dict) -> Optional[int]:
+    """Get the first row number written by an append_row/append_rows call"""
+    try:
+        updated_range = response['updates']['updatedRange']
+    except (KeyError, TypeError):
+        return None
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    return int(match.group(1)) if match else None
+
+class StateStore:
+    """Local indexed copy of the post state kept in the social media sheet
+
+    The sheet stays the source of truth that people look at; this store answers
+    "have we seen this post" and "which row is it on" without downloading the sheet.
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS posts (
+                    post_id TEXT PRIMARY KEY,
+                    id INTEGER,
+                    row_number INTEGER,
+                    message_sent INTEGER NOT NULL DEFAULT 0,
+                    wa_no TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_posts_row_number ON posts (row_number);
+                CREATE INDEX IF NOT EXISTS idx_posts_message_sent ON posts (message_sent);
+                CREATE INDEX IF NOT EXISTS idx_posts_wa_no ON posts (wa_no);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS queued_updates (
+                    post_id TEXT NOT NULL,
+                    column_number INTEGER NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (post_id, column_number)
+                );
+            """)
+            # Earlier versions keyed queued changes by sheet row; rows can move, so re-key them by post
+            if self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pending_updates'"
+            ).fetchone():
+                self.conn.execute("""
+                    INSERT OR REPLACE INTO queued_updates (post_id, column_number, value)
+                    SELECT posts.post_id, pending_updates.column_number, pending_updates.value
+                    FROM pending_updates JOIN posts ON posts.row_number = pending_updates.row_number
+                """)
+                self.conn.execute("DROP TABLE pending_updates")
+
+    def __contains__(self, post_id) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM posts WHERE post_id = ?", (str(post_id),)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def is_synced(self) -> bool:
+        """Check whether the store has been loaded from the sheet at least once"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'synced_at'").fetchone()
+        return row is not None
+
+    def rebuild(self, records: List[Dict]) -> None:
+        """Replace the store contents with records read from the sheet (row 1 is the header)"""
+        rows = [
+            (
+                str(record['post_id']),
+                int(record['id']) if str(record.get('id', '')).strip() else None,
+                index + 2,
+                1 if str(record.get('message_sent', '0')) in ['1', '1.0', '1.00'] else 0,
+                str(record.get('wa_no', '')) or None
+            )
+            for index, record in enumerate(records)
+            if str(record.get('post_id', '')).strip()
+        ]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM posts")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO posts (post_id, id, row_number, message_sent, wa_no) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)",
+                (datetime.now().isoformat(),)
+            )
+
+    def add_post(self, post_id, id: Optional[int] = None, row_number: Optional[int] = None,
+                 wa_no: Optional[str] = None) -> None:
+        """Record a post that was written to the sheet"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO posts (post_id, id, row_number, message_sent, wa_no) VALUES (?, ?, ?, 0, ?)",
+                (str(post_id), id, row_number, wa_no or None)
+            )
+
+    def update_post(self, post_id, message_sent: Optional[bool] = None,
+                    wa_no: Optional[str] = None) -> None:
+        """Record a status or WhatsApp number change made to a post's sheet row"""
+        with self.lock, self.conn:
+            if message_sent is not None:
+                self.conn.execute(
+                    "UPDATE posts SET message_sent = ? WHERE post_id = ?",
+                    (1 if message_sent else 0, str(post_id))
+                )
+            if wa_no is not None:
+                self.conn.execute(
+                    "UPDATE posts SET wa_no = ? WHERE post_id = ?",
+                    (str(wa_no), str(post_id))
+                )
+
+    def get_row_number(self, post_id) -> Optional[int]:
+        """Get the sheet row a post was written to"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT row_number FROM posts WHERE post_id = ?", (str(post_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def queue_update(self, post_id, column: int, value: str) -> None:
+        """Keep a sheet cell change until it has been written, so it survives a failed write or a restart"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO queued_updates (post_id, column_number, value) VALUES (?, ?, ?)",
+                (str(post_id), column, value)
+            )
+
+    def pending_updates(self) -> Dict[Tuple[str, int], str]:
+        """Get the queued cell changes as (post_id, column) -> value"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT post_id, column_number, value FROM queued_updates"
+            ).fetchall()
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def clear_updates(self, updates: Dict[Tuple[str, int], str]) -> None:
+        """Forget cell changes that have been written to the sheet or can no longer be"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM queued_updates WHERE post_id = ? AND column_number = ? AND value = ?",
+                [(post_id, column, value) for (post_id, column), value in updates.items()]
+            )
@@ -0,0 +1,135 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+WATERMARK_FILE = "db/watermarks.json"
+# Watermarks of scraped posts that haven't been processed yet
+PENDING_WATERMARK_FILE = "db/watermarks.pending.json"
+
+def normalize_group_url(url: str) -> str:
+    """Normalize a group URL so sheet URLs and scraped URLs compare equal"""
+    return url.strip().rstrip('/')
+
+def get_group_url(item: Dict) -> Optional[str]:
+    """Get the group URL a scraped post came from"""
+    url = item.get('inputUrl') or item.get('facebookUrl')
+    return normalize_group_url(url) if url else None
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO timestamp as returned by the scraper"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def merge_newest(watermarks: Dict[str, Dict], updates: Dict[str, Dict]) -> None:
+    """Merge watermarks into `watermarks`, keeping the newest one for each group"""
+    for group_url, watermark in updates.items():
+        current = watermarks.get(group_url)
+        if current and parse_timestamp(current['timestamp']) >= parse_timestamp(watermark['timestamp']):
+            continue
+        watermarks[group_url] = watermark
+
+def load_json(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_json(path: str, data: Dict) -> None:
+    """Write a JSON file atomically"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+class WatermarkStore:
+    """Newest post id and timestamp seen for each Facebook group
+
+    Watermarks of a scrape are first staged in a pending file next to the
+    store and only committed once the scraped posts have been processed, so a
+    failed processing run never skips posts that were scraped but not stored.
+    """
+
+    def __init__(self, path: str = WATERMARK_FILE, pending_path: str = PENDING_WATERMARK_FILE):
+        self.path = path
+        self.pending_path = pending_path
+        self.watermarks: Dict[str, Dict] = load_json(path)
+        self._pending: Dict[str, Dict] = {}
+
+    def get(self, group_url: str) -> Optional[Dict]:
+        """Get the stored watermark for a group URL"""
+        return self.watermarks.get(normalize_group_url(group_url))
+
+    def oldest_timestamp(self, group_urls: List[str]) -> Optional[datetime]:
+        """Get the oldest watermark timestamp among the given groups"""
+        timestamps = []
+        for url in group_urls:
+            watermark = self.get(url)
+            timestamp = parse_timestamp(watermark['timestamp']) if watermark else None
+            if timestamp is None:
+                return None
+            timestamps.append(timestamp)
+        return min(timestamps) if timestamps else None
+
+    def is_new(self, item: Dict) -> bool:
+        """Check whether a scraped post is newer than its group's watermark"""
+        group_url = get_group_url(item)
+        watermark = self.watermarks.get(group_url) if group_url else None
+        if not watermark:
+            return True
+        if str(item.get('id', '')) == watermark['post_id']:
+            return False
+        item_time = parse_timestamp(item.get('time'))
+        watermark_time = parse_timestamp(watermark['timestamp'])
+        if item_time is None or watermark_time is None:
+            return True
+        return item_time >= watermark_time
+
+    def observe(self, item: Dict, observed: Optional[Dict[str, Dict]] = None) -> None:
+        """Track a scraped post as a candidate for advancing its group's watermark
+
+        Pass `observed` to collect candidates for one actor run separately, and
+        accept them once that run has succeeded.
+        """
+        observed = self._pending if observed is None else observed
+        group_url = get_group_url(item)
+        item_time = parse_timestamp(item.get('time'))
+        if not group_url or item_time is None:
+            return
+        current = observed.get(group_url) or self.watermarks.get(group_url)
+        if current and parse_timestamp(current['timestamp']) >= item_time:
+            return
+        observed[group_url] = {
+            "post_id": str(item.get('id', '')),
+            "timestamp": item_time.isoformat()
+        }
+
+    def accept(self, observed: Dict[str, Dict]) -> None:
+        """Keep the watermarks observed by a successful run for staging"""
+        merge_newest(self._pending, observed)
+
+    def stage(self) -> int:
+        """Save the observed watermarks as pending until the scraped posts are processed"""
+        if not self._pending:
+            return 0
+        pending = load_json(self.pending_path)
+        merge_newest(pending, self._pending)
+        staged = len(self._pending)
+        self._pending = {}
+        save_json(self.pending_path, pending)
+        return staged
+
+    def commit(self) -> int:
+        """Advance watermarks to the staged ones once their posts have been processed"""
+        pending = load_json(self.pending_path)
+        if not pending:
+            return 0
+        merge_newest(self.watermarks, pending)
+        save_json(self.path, self.watermarks)
+        os.remove(self.pending_path)
+        return len(pending)